@@ -1,110 +1,674 @@
+import os
+import json
+import time
 import random
+from collections import OrderedDict
+
+
+_bit_count = getattr(int, 'bit_count', lambda m: bin(m).count('1'))  # Python 3.10 以前没有 int.bit_count
+
+
+class BoardGeometry:
+    """ N x N 棋盘, 连成 k 子获胜: 连线、位置权重、对称变换等只和尺寸有关的数据 """
+
+    TABLE_LIMIT = 12  # 格子数不超过此值时预先生成 掩码 -> 位置/子数/对称变换 的查找表
+
+    def __init__(self, n=3, k=None):
+        self.n = n
+        self.k = min(n, 4) if k is None else k  # 默认 3x3 连三, 更大的棋盘连四
+        if not 2 <= self.k <= n:
+            raise ValueError(f"连子数 k={self.k} 必须在 2 到 {n} 之间")
+
+        self.size = n * n
+        self.full_mask = (1 << self.size) - 1
+        self.win_lines = self._win_lines()
+        self.win_masks = [sum(1 << i for i in line) for line in self.win_lines]  # 每条连线对应的位掩码
+
+        lines_through = [0] * self.size
+        for line in self.win_lines:
+            for i in line:
+                lines_through[i] += 1
+        self.position_weights = [max(0, c - 1) for c in lines_through]  # 3x3 时为 [2, 1, 2, 1, 3, 1, 2, 1, 2]
+
+        self.symmetry_maps = self._symmetry_maps()
+        self.inverse_maps = [[dest.index(i) for i in range(self.size)] for dest in self.symmetry_maps]
+
+        if self.size <= self.TABLE_LIMIT:
+            masks = range(1 << self.size)
+            self.popcount_table = [_bit_count(m) for m in masks]
+            self.positions_table = [tuple(i for i in range(self.size) if m >> i & 1) for m in masks]
+            self.symmetry_tables = [self._mask_table(dest) for dest in self.symmetry_maps]
+            self.inverse_tables = [self._mask_table(dest) for dest in self.inverse_maps]
+        else:
+            self.popcount_table = self.positions_table = None
+            self.symmetry_tables = self.inverse_tables = None
+
+    def _win_lines(self):
+        """ 按 行、列、对角线、反对角线 的顺序生成所有长度为 k 的连线 """
+        n, k = self.n, self.k
+        lines = []
+        for dr, dc in ((0, 1), (1, 0), (1, 1), (1, -1)):
+            for r in range(n):
+                for c in range(n):
+                    end_r, end_c = r + dr * (k - 1), c + dc * (k - 1)
+                    if 0 <= end_r < n and 0 <= end_c < n:
+                        lines.append([(r + dr * i) * n + c + dc * i for i in range(k)])
+        return lines
+
+    def _symmetry_maps(self):
+        """ 8 种二面体对称 (4 种旋转 x 是否镜像), 每种给出格子 i 变换后的位置 """
+        m = self.n - 1
+        transforms = [
+            lambda r, c: (r, c),
+            lambda r, c: (c, m - r),
+            lambda r, c: (m - r, m - c),
+            lambda r, c: (m - c, r),
+            lambda r, c: (r, m - c),
+            lambda r, c: (m - r, c),
+            lambda r, c: (c, r),
+            lambda r, c: (m - c, m - r),
+        ]
+        maps = []
+        for t in transforms:
+            cells = [t(i // self.n, i % self.n) for i in range(self.size)]
+            maps.append([r * self.n + c for r, c in cells])
+        return maps
+
+    def _mask_table(self, dest):
+        """ 按位置映射 dest 变换全部掩码 """
+        return [self._map_mask(m, dest) for m in range(1 << self.size)]
+
+    @staticmethod
+    def _map_mask(mask, dest):
+        result = 0
+        while mask:
+            low = mask & -mask
+            result |= 1 << dest[low.bit_length() - 1]
+            mask ^= low
+        return result
+
+    def popcount(self, mask):
+        if self.popcount_table is not None:
+            return self.popcount_table[mask]
+        return _bit_count(mask)
+
+    def positions(self, mask):
+        """ 掩码中为 1 的位置, 从小到大 """
+        if self.positions_table is not None:
+            return self.positions_table[mask]
+
+        result = []
+        while mask:
+            low = mask & -mask
+            result.append(low.bit_length() - 1)
+            mask ^= low
+        return tuple(result)
+
+    def transform(self, mask, sym):
+        if self.symmetry_tables is not None:
+            return self.symmetry_tables[sym][mask]
+        return self._map_mask(mask, self.symmetry_maps[sym])
+
+    def inverse(self, mask, sym):
+        if self.inverse_tables is not None:
+            return self.inverse_tables[sym][mask]
+        return self._map_mask(mask, self.inverse_maps[sym])
+
+    def canonical(self, own, opp):
+        """ 8 种对称中键最小的形式作为规范局面, 返回 (规范键, 所用对称编号) """
+        best_key, best_sym = None, 0
+        for sym in range(len(self.symmetry_maps)):
+            key = self.transform(own, sym) | self.transform(opp, sym) << self.size
+            if best_key is None or key < best_key:
+                best_key, best_sym = key, sym
+        return best_key, best_sym
+
+    def has_win(self, mask):
+        """ 逐条连线做掩码比较判断是否连成一线 """
+        for w in self.win_masks:
+            if mask & w == w:
+                return True
+        return False
+
+
+_geometries = {}
+
+
+def get_geometry(n=3, k=None):
+    """ 同样尺寸的棋盘共用一份几何数据 """
+    key = (n, min(n, 4) if k is None else k)
+    if key not in _geometries:
+        _geometries[key] = BoardGeometry(*key)
+    return _geometries[key]
+
+
+# 3x3 连三的数据, 完美策略表和旧接口使用
+GEOMETRY_3 = get_geometry(3, 3)
+
+WIN_LINES = GEOMETRY_3.win_lines
+FULL_MASK = GEOMETRY_3.full_mask
+WIN_MASKS = GEOMETRY_3.win_masks
+
+POPCOUNT = GEOMETRY_3.popcount_table         # 9 位掩码中 1 的个数
+MASK_POSITIONS = GEOMETRY_3.positions_table  # 9 位掩码中为 1 的位置
+
+SYMMETRY_MAPS = GEOMETRY_3.symmetry_maps
+SYMMETRY_TABLES = GEOMETRY_3.symmetry_tables  # 正向变换
+INVERSE_TABLES = GEOMETRY_3.inverse_tables    # 逆变换
+
+
+class BitBoard:
+    """ 用两个 n*n 位掩码表示的棋盘, 第 i 位对应第 i 格; first/second 分别为两方的棋子 """
+
+    __slots__ = ('first', 'second', 'n')
+
+    def __init__(self, first=0, second=0, n=3):
+        self.first = first
+        self.second = second
+        self.n = n
+
+    @classmethod
+    def from_list(cls, board, players=(-1, 1), empty=0, n=None):
+        """ 由视觉模块的 [-1, 0, 1] 列表转换, players[0] 为 first, players[1] 为 second; n 默认由列表长度推算 """
+        if n is None:
+            n = int(round(len(board) ** 0.5))
+
+        first = second = 0
+        for i, v in enumerate(board):
+            if v == players[0]:
+                first |= 1 << i
+            elif v == players[1]:
+                second |= 1 << i
+        return cls(first, second, n)
+
+    def to_list(self, players=(-1, 1), empty=0):
+        return [players[0] if self.first >> i & 1 else players[1] if self.second >> i & 1 else empty
+                for i in range(self.n * self.n)]
+
+    @property
+    def occupied(self):
+        return self.first | self.second
+
+    @property
+    def empty_mask(self):
+        return ((1 << self.n * self.n) - 1) & ~(self.first | self.second)
+
+    def empty_count(self):
+        return _bit_count(self.empty_mask)
+
+    def empty_positions(self):
+        return get_geometry(self.n).positions(self.empty_mask)
+
+    def play(self, pos, second=False):
+        """ 返回在 pos 落子后的新棋盘 """
+        if second:
+            return BitBoard(self.first, self.second | 1 << pos, self.n)
+        return BitBoard(self.first | 1 << pos, self.second, self.n)
+
+    def swapped(self):
+        return BitBoard(self.second, self.first, self.n)
+
+    def key(self):
+        """ 2*n*n 位整数, 作为查表的键 """
+        return self.first | self.second << self.n * self.n
+
+    def __eq__(self, other):
+        return (isinstance(other, BitBoard) and self.n == other.n
+                and self.first == other.first and self.second == other.second)
+
+    def __hash__(self):
+        return hash((self.n, self.key()))
+
+    def __repr__(self):
+        width = self.n * self.n + 2
+        return f"BitBoard({self.first:#0{width}b}, {self.second:#0{width}b}, n={self.n})"
+
+
+def has_win(mask):
+    """ 3x3 棋盘, 8 次掩码比较判断是否连成一线 """
+    for w in WIN_MASKS:
+        if mask & w == w:
+            return True
+    return False
+
+
+def canonical(own, opp):
+    """ 3x3 棋盘的规范局面, 返回 (规范键, 所用对称编号) """
+    return GEOMETRY_3.canonical(own, opp)
+
+
+def _solve(own, opp, table):
+    """ 负极大值搜索, own/opp 为当前方和对手的掩码, 返回当前方的分数: 赢为正, 输为负, 越快赢分数越高; 结果写入 table """
+
+    key = own | opp << 9
+    if key in table:
+        return table[key][0]
+
+    empty = FULL_MASK & ~(own | opp)
+    empties = POPCOUNT[empty]
+
+    if has_win(opp):    # 对手已连成一线
+        table[key] = (-(empties + 1), 0)
+        return table[key][0]
+    if has_win(own):    # 视觉输入中可能出现的非法局面
+        table[key] = (empties + 1, 0)
+        return table[key][0]
+    if not empty:
+        table[key] = (0, 0)
+        return 0
+
+    best_score = None
+    best_moves = 0  # 所有最优落子位置的位掩码
+    for pos in MASK_POSITIONS[empty]:
+        score = -_solve(opp, own | 1 << pos, table)  # 换到对手视角
+
+        if best_score is None or score > best_score:
+            best_score, best_moves = score, 1 << pos
+        elif score == best_score:
+            best_moves |= 1 << pos
+
+    table[key] = (best_score, best_moves)
+    return best_score
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+class AlphaBetaSearch:
+    """ 任意尺寸棋盘的 alpha-beta 负极大值搜索, 迭代加深, 超过每步时间预算时返回上一层完整搜索的结果 """
+
+    WIN = 1_000_000          # 胜负分数, 加上剩余空格数, 越快赢分数越高
+    EXACT, LOWER, UPPER = 0, 1, 2
+
+    def __init__(self, geometry, time_budget=1.0, max_table=200_000):
+        self.geometry = geometry
+        self.time_budget = time_budget  # 每步的时间预算 s
+        self.max_table = max_table      # 置换表容量, 超过时清空
+
+        self.table = {}      # 置换表: 键 -> (深度, 分数, 类型, 最佳位置)
+        self.deadline = 0.0
+        self.nodes = 0
+        self.last_depth = 0  # 上一次搜索完成的深度
+        self.last_score = 0
+        self.last_time = 0.0
+
+        # 分数常量只和连子数有关, 启发式中 k-1 子的连线远小于胜负分数
+        self.line_scores = [0] + [10 ** c for c in range(geometry.k)]
+
+    def evaluate(self, own, opp):
+        """ 局面评估: 只被一方占据的连线按子数计分 """
+        score = 0
+        popcount = self.geometry.popcount
+        for w in self.geometry.win_masks:
+            o = own & w
+            p = opp & w
+            if o and not p:
+                score += self.line_scores[popcount(o)]
+            elif p and not o:
+                score -= self.line_scores[popcount(p)]
+        return score
+
+    def ordered_moves(self, empty, first=None):
+        """ 连线多的位置优先, 置换表中的最佳位置最先 """
+        weights = self.geometry.position_weights
+        moves = sorted(self.geometry.positions(empty), key=lambda pos: -weights[pos])
+        if first is not None and first in moves:
+            moves.remove(first)
+            moves.insert(0, first)
+        return moves
+
+    def negamax(self, own, opp, depth, alpha, beta):
+        self.nodes += 1
+        if self.nodes & 255 == 0 and time.perf_counter() > self.deadline:
+            raise SearchTimeout()
+
+        g = self.geometry
+        empty = g.full_mask & ~(own | opp)
+
+        if g.has_win(opp):   # 对手已连成一线
+            return -(self.WIN + g.popcount(empty))
+        if g.has_win(own):   # 视觉输入中可能出现的非法局面
+            return self.WIN + g.popcount(empty)
+        if not empty:
+            return 0
+        if depth == 0:
+            return self.evaluate(own, opp)
+
+        key = own | opp << g.size
+        entry = self.table.get(key)
+        best_pos = None
+        if entry is not None:
+            entry_depth, value, flag, best_pos = entry
+            if entry_depth >= depth:
+                if flag == self.EXACT:
+                    return value
+                if flag == self.LOWER:
+                    alpha = max(alpha, value)
+                elif flag == self.UPPER:
+                    beta = min(beta, value)
+                if alpha >= beta:
+                    return value
+
+        alpha_orig = alpha
+        best = None
+        for pos in self.ordered_moves(empty, best_pos):
+            score = -self.negamax(opp, own | 1 << pos, depth - 1, -beta, -alpha)
+            if best is None or score > best:
+                best, best_pos = score, pos
+            if score > alpha:
+                alpha = score
+            if alpha >= beta:
+                break
+
+        if best <= alpha_orig:
+            flag = self.UPPER
+        elif best >= beta:
+            flag = self.LOWER
+        else:
+            flag = self.EXACT
+
+        if len(self.table) >= self.max_table:
+            self.table.clear()
+        self.table[key] = (depth, best, flag, best_pos)
+        return best
+
+    def search_root(self, own, opp, depth, first=None):
+        """ 搜索一层根节点, 返回 (最优分数, 所有同分最优位置的掩码) """
+        g = self.geometry
+        inf = self.WIN * 2
+        best, moves = None, 0
+
+        for pos in self.ordered_moves(g.full_mask & ~(own | opp), first):
+            alpha = -inf if best is None else best - 1  # 窗口留到 best - 1, 同分的位置也能得到准确分数
+            score = -self.negamax(opp, own | 1 << pos, depth - 1, -inf, -alpha)
+
+            if best is None or score > best:
+                best, moves = score, 1 << pos
+            elif score == best:
+                moves |= 1 << pos
+
+        return best, moves
+
+    def search(self, own, opp):
+        """ 迭代加深搜索, 返回所有最优位置的掩码; 连第一层都没搜完时返回 0 """
+
+        start = time.perf_counter()
+        self.deadline = start + self.time_budget
+        self.nodes = 0
+        self.table.clear()
+
+        g = self.geometry
+        empties = g.popcount(g.full_mask & ~(own | opp))
+        result, first = 0, None
+        self.last_depth = 0
+
+        for depth in range(1, empties + 1):
+            try:
+                score, moves = self.search_root(own, opp, depth, first)
+            except SearchTimeout:
+                break
+
+            result, first = moves, g.positions(moves)[0]
+            self.last_depth, self.last_score = depth, score
+
+            if abs(score) >= self.WIN:  # 已经算出胜负, 更深的搜索不会改变结果
+                break
+
+        self.last_time = time.perf_counter() - start
+        return result
+
+
+class MoveCache:
+    """ 规范局面 -> 最优落子掩码 的缓存, 容量有限, 按最近最少使用淘汰 """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        moves = self.data.get(key)
+        if moves is None:
+            self.misses += 1
+            return None
+        self.data.move_to_end(key)
+        self.hits += 1
+        return moves
+
+    def put(self, key, moves):
+        self.data[key] = moves
+        self.data.move_to_end(key)
+        if len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def clear(self):
+        self.data.clear()
+        self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self.data)
+
+
+TABLE_VERSION = 2  # 键的编码方式改变时递增, 旧的缓存文件会被忽略
+
+
+def build_perfect_table():
+    """ 从空棋盘出发穷举所有可达局面 (以当前方视角, 5000 多个), 返回 {键: (分数, 最优位置掩码)} """
+    table = {}
+    _solve(0, 0, table)
+    return table
+
+
+def save_perfect_table(table, path):
+    with open(path, 'w') as f:
+        json.dump({'version': TABLE_VERSION, 'table': {str(key): value for key, value in table.items()}}, f)
+
+
+def load_perfect_table(path):
+    """ 载入缓存的策略表, 版本不符时返回 None """
+    with open(path) as f:
+        data = json.load(f)
+
+    if not isinstance(data, dict) or data.get('version') != TABLE_VERSION:
+        print(f"策略表缓存 {path} 版本不符, 重新生成")
+        return None
+    return {int(key): tuple(value) for key, value in data['table'].items()}
+
+
+_perfect_table = None  # 整个进程共用一张完美策略表
+
+
+def get_perfect_table(path=None):
+    """ 获取完美策略表: 已有缓存文件时直接载入, 否则穷举生成 (指定了 path 时顺便保存) """
+
+    global _perfect_table
+    if _perfect_table is None:
+        path = path or os.environ.get('TTT_TABLE')
+        if path and os.path.exists(path):
+            _perfect_table = load_perfect_table(path)
+
+        if _perfect_table is None:
+            _perfect_table = build_perfect_table()
+            if path:
+                save_perfect_table(_perfect_table, path)
+    return _perfect_table
+
 
 class TicTacToeAI:
-    def __init__(self, player1=-1, player2=1, empty=0):
+    # perfect: 3x3 连三时查表完美下法, 其他尺寸同 search
+    # search:  alpha-beta 迭代加深搜索, 受每步时间预算限制
+    # casual:  单步启发式, 可能被双杀
+    LEVELS = ('perfect', 'search', 'casual')
+
+    def __init__(self, player1=-1, player2=1, empty=0, level='perfect', table_path=None, seed=None, cache_size=1024,
+                 n=3, k=None, time_budget=1.0):
+        if level not in self.LEVELS:
+            raise ValueError(f"未知的难度: {level}, 可选 {self.LEVELS}")
+
         self.players = [player1, player2]
         self.empty = empty
-        self.win_lines = [
-            [0, 1, 2], [3, 4, 5], [6, 7, 8],  # 行
-            [0, 3, 6], [1, 4, 7], [2, 5, 8],  # 列
-            [0, 4, 8], [2, 4, 6]              # 对角线
-        ]
+        self.level = level
+
+        self.geometry = get_geometry(n, k)
+        self.n, self.k = self.geometry.n, self.geometry.k
+        self.win_lines = self.geometry.win_lines
+        self.position_weights = self.geometry.position_weights
+
+        use_table = level == 'perfect' and self.n == 3 and self.k == 3  # 只有 3x3 连三能穷举
+        self.table = get_perfect_table(table_path) if use_table else None
+        self.search = AlphaBetaSearch(self.geometry, time_budget) if level != 'casual' and not use_table else None
+
+        self.rng = random.Random(seed)      # 指定 seed 时对局可复现
+        self.cache = MoveCache(cache_size)  # 规范局面 -> 最优落子
+
+    def to_bitboard(self, board):
+        """ 所有方法都接受列表或 BitBoard, 列表在这里转换一次 """
+        if isinstance(board, BitBoard):
+            return board
+        return BitBoard.from_list(board, self.players, self.empty, self.n)
+
+    def player_masks(self, bb, player):
+        """ 返回 (player 的掩码, 对手的掩码) """
+        if player == self.players[0]:
+            return bb.first, bb.second
+        return bb.second, bb.first
 
     def get_empty_positions(self, board):
-        return [i for i in range(9) if board[i] == self.empty]
+        return list(self.to_bitboard(board).empty_positions())
 
     def check_win(self, board, player):
-        for line in self.win_lines:
-            if all(board[i] == player for i in line):
-                return True
-        return False
+        own, _ = self.player_masks(self.to_bitboard(board), player)
+        return self.geometry.has_win(own)
 
     def check_game_over(self, board):
         """ 检查游戏是否结束 """
-        if len(board) != 9:
+        if not isinstance(board, BitBoard) and len(board) != self.geometry.size:
             print("棋盘状态不正确，请检查视觉识别输入。")
             return False
-         
-        for player in self.players:
-            if self.check_win(board, player):
-                return player  # 返回获胜玩家 ID
-        
-        if not self.get_empty_positions(board):
+
+        bb = self.to_bitboard(board)
+
+        if self.geometry.has_win(bb.first):
+            return self.players[0]  # 返回获胜玩家 ID
+        if self.geometry.has_win(bb.second):
+            return self.players[1]
+
+        if not bb.empty_mask:
             return 99  # 平局返回99
-        
+
         return False   # 未结束返回False
 
     def evaluate_move(self, board, pos, player):
         """ 评估当前状态下的每个位置的分数 """
-        temp_board = board.copy()
-        temp_board[pos] = player
+        own, opp = self.player_masks(self.to_bitboard(board), player)
+        return self._score_move(own, opp, pos)
+
+    def _score_move(self, own, opp, pos):
+        g = self.geometry
+        empty = g.full_mask & ~(own | opp)
+        bit = 1 << pos
+        new_own = own | bit
         score = 0
-        opponent = self.players[1] if player == self.players[0] else self.players[0]
 
         # 检查当前玩家是否直接胜利
-        if self.check_win(temp_board, player):
+        if g.has_win(new_own):
             return float('inf')
 
-        # 防御得分
-        for line in self.win_lines:
-            values = [board[i] for i in line]
-            
-            if values.count(opponent) == 2 and self.empty in values:
-                empty_pos = next((line[idx] for idx, val in enumerate(values) if val == self.empty), None)
-                if empty_pos == pos:
-                    score += 50 if values.count(opponent) == 1 else 100
-
-        # 进攻得分
-        for line in self.win_lines:
-            values = [temp_board[i] for i in line]
-            if values.count(player) == 2 and self.empty in values:
+        for w in g.win_masks:
+            # 防御得分: 对手在这条线上已有 k-1 子, pos 是剩下的空位
+            if g.popcount(opp & w) == g.k - 1 and empty & w == bit:
+                score += 100
+
+            # 进攻得分: 落子后这条线上有 k-1 子且还有空位
+            if g.popcount(new_own & w) == g.k - 1 and empty & ~bit & w:
                 score += 10
 
         # 位置权重
-        position_weights = [2, 1, 2, 
-                           1, 3, 1, 
-                           2, 1, 2]
-        score += position_weights[pos]
+        score += g.position_weights[pos]
 
         return score
 
+    def _casual_moves_mask(self, own, opp):
+        """ 启发式得分最高的所有位置的掩码 """
+        best_score, best_moves = None, 0
+        for pos in self.geometry.positions(self.geometry.full_mask & ~(own | opp)):
+            score = self._score_move(own, opp, pos)
+            if best_score is None or score > best_score:
+                best_score, best_moves = score, 1 << pos
+            elif score == best_score:
+                best_moves |= 1 << pos
+        return best_moves
+
+    def _perfect_moves_mask(self, own, opp):
+        """ 查表得到所有最优位置的掩码, 表中没有的局面 (视觉误判造成的非法局面) 现场搜索并补进表里 """
+        key = own | opp << 9
+        if key not in self.table:
+            _solve(own, opp, self.table)
+        return self.table[key][1]
+
+    def _best_moves_mask(self, own, opp):
+        moves = 0
+        if self.table is not None:
+            moves = self._perfect_moves_mask(own, opp)
+        elif self.search is not None and not self.geometry.has_win(own) and not self.geometry.has_win(opp):
+            moves = self.search.search(own, opp)
+            print(f"搜索深度 {self.search.last_depth}, 节点 {self.search.nodes}, 耗时 {self.search.last_time:.2f} s")
+        if not moves:  # 已分出胜负的局面没有最优解, 或时间不够搜完第一层, 交给启发式
+            moves = self._casual_moves_mask(own, opp)
+        return moves
+
+    def find_best_moves(self, board, current_player):
+        """ 所有同样好的落子位置: 在规范局面上计算并缓存, 再变换回实际方向 """
+
+        g = self.geometry
+        own, opp = self.player_masks(self.to_bitboard(board), current_player)
+        key, sym = g.canonical(own, opp)
+
+        moves = self.cache.get(key)
+        if moves is None:
+            moves = self._best_moves_mask(key & g.full_mask, key >> g.size)
+            self.cache.put(key, moves)
+
+        return list(g.positions(g.inverse(moves, sym)))
+
+    def find_perfect_moves(self, board, current_player):
+        """ 查表得到所有最优落子位置, 只适用于 3x3 连三 """
+        if self.table is None:
+            self.table = get_perfect_table()
+        own, opp = self.player_masks(self.to_bitboard(board), current_player)
+        return list(MASK_POSITIONS[self._perfect_moves_mask(own, opp)])
+
     def find_best_move(self, board, current_player):
-        """ AI寻找最佳落子位置 """
-        empty = self.get_empty_positions(board)
-        if not empty:
+        """ AI寻找最佳落子位置, 同样好的位置之间等概率选择 """
+        moves = self.find_best_moves(board, current_player)
+        if not moves:
             return None
 
-        best_pos = None
-        max_score = -float('inf')
-
-        for pos in empty:
-            score = self.evaluate_move(board, pos, current_player)
-            if score > max_score:
-                max_score = score
-                best_pos = pos
-            elif score == max_score:
-                best_pos = random.choice([best_pos, pos])
-        
+        best_pos = self.rng.choice(moves)
         print(f"AI选择位置: {best_pos}")
 
         return best_pos
-    
+
     def find_board_changes(self, board_before, board_after):
         """ 寻找棋子变化 """
-        if len(board_before) != len(board_after):
+        if not isinstance(board_before, BitBoard) and len(board_before) != len(board_after):
             print("棋盘状态不一致，无法比较。")
             return []
-        
-        changes = []  # 存储变化信息
-        
-        for i in range(9):  # 遍历每个位置
-            if board_before[i] != board_after[i]:
-                changes.append((i, board_before[i], board_after[i]))
+
+        before = self.to_bitboard(board_before)
+        after = self.to_bitboard(board_after)
+        changed = (before.first ^ after.first) | (before.second ^ after.second)
+
+        before_list = before.to_list(self.players, self.empty)
+        after_list = after.to_list(self.players, self.empty)
+        changes = [(i, before_list[i], after_list[i]) for i in self.geometry.positions(changed)]  # 存储变化信息
 
         print("棋子变化:", changes)
 
         return changes
-    
+
     def find_board_fix(self, changes):
         fix_changes = [0, 0]
 
@@ -125,39 +689,46 @@ class TicTacToeAI:
 
 
 
+def print_board(board, empty=0):
+    """ 按 n x n 打印棋盘, n 由列表长度推算 """
+    n = int(round(len(board) ** 0.5))
+    print("-" * (4 * n + 1))
+    for i in range(0, n * n, n):
+        print("|", end=' ')
+        for j in range(n):
+            print(board[i+j] if board[i+j] != empty else '.', end=' | ')
+        print("\n" + "-" * (4 * n + 1))
+
+
 class TicTacToeGame:
-    def __init__(self, player1=-1, player2=1, empty=0):
-        self.ai = TicTacToeAI(player1, player2, empty)
-        self.board = [empty] * 9
+    def __init__(self, player1=-1, player2=1, empty=0, seed=None, n=3, k=None):
+        self.ai = TicTacToeAI(player1, player2, empty, seed=seed, n=n, k=k)
+        self.size = self.ai.geometry.size
+        self.board = [empty] * self.size
         self.current_player = player1
         self.player1 = player1
         self.player2 = player2
         self.empty = empty
 
     def print_board(self):
-        print("-------------")
-        for i in range(0, 9, 3):
-            print("|", end=' ')
-            for j in range(3):
-                print(self.board[i+j] if self.board[i+j] != self.empty else '.', end=' | ')
-            print("\n-------------")
+        print_board(self.board, self.empty)
 
     def player_move(self):
         while True:
             try:
-                move = int(input(f"请输入落子位置 (1-9), 你执{self.current_player}: ")) - 1
-                if 0 <= move < 9 and self.board[move] == self.empty:
+                move = int(input(f"请输入落子位置 (1-{self.size}), 你执{self.current_player}: ")) - 1
+                if 0 <= move < self.size and self.board[move] == self.empty:
                     return move
                 print("位置无效, 请重新输入")
             except ValueError:
-                print("请输入数字1-9")
+                print(f"请输入数字1-{self.size}")
 
     def play(self, first_move=0):
         print(f"游戏开始！玩家: {self.player1}, AI: {self.player2}")
         
         if first_move > 0:
             move = first_move - 1
-            if 0 <= move < 9 and self.board[move] == self.empty:
+            if 0 <= move < self.size and self.board[move] == self.empty:
                 self.board[move] = self.player2
                 self.current_player = self.player1
                 print(f"AI先手，选择位置: {first_move}")
@@ -165,7 +736,7 @@ class TicTacToeGame:
                 print(f"位置{first_move}无效，AI将随机选择位置")
                 empty = self.ai.get_empty_positions(self.board)
                 if empty:
-                    pos = random.choice(empty)
+                    pos = self.ai.rng.choice(empty)
                     self.board[pos] = self.player2
                     self.current_player = self.player1
         
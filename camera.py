@@ -1,29 +1,20 @@
 import os
+import json
 import time
+import argparse
 import threading
+import collections
 
 import cv2
+import numpy as np
 
 import tags
 import chess 
-
-
-# 摄像头参数
-camera_params = {
-    'camera_id': "/dev/video-4k",
-    # 'camera_id': 0,
-    # 'image_width': 1920,
-    # 'image_height': 1080,
-    'image_width': 1280,
-    'image_height': 720,
-    'auto_exposure': 1,
-    'exposure_time': 5000,
-    'fps': 30,
-    'gain': 100,
-    'auto_wb': 0,
-    'wb_temperature': 5000,
-    'contrast': 42,
-}
+import debug_sink
+from preview import PreviewServer
+from profiler import StageTimer
+from scheduler import get_scheduler
+from source import camera_params, create_source  # camera_params 保留在这里供旧代码引用
 
 
 def time_diff(last_time=[None]):
@@ -40,143 +31,494 @@ def time_diff(last_time=[None]):
         return diff                         # 返回时间差 ns
 
 
+# 每帧的识别结果, 不可变, 整体原子发布
+FrameResult = collections.namedtuple('FrameResult', [
+    'frame_id',            # 帧序号, 从 1 开始递增
+    'timestamp',           # 拍摄时间 time.time()
+    'latency',             # 从拍摄到发布的处理耗时 s
+    'corners',             # 棋盘角点
+    'center_points',       # 棋盘格中心点
+    'board_chess_colors',  # 棋盘格颜色分布 (经过时间投票滤波)
+    'board_confidence',    # 每格颜色的置信度, 0~1
+    'raw_board_chess_colors',  # 单帧识别的棋盘格颜色分布
+    'black_coords',        # 背景黑棋位置
+    'white_coords',        # 背景白棋位置
+    'motion',              # 与上一帧的帧差运动量, 0~1
+    'end_to_end',          # 从抓取到发布的总耗时 s, 包含在队列中等待的时间
+])
+
+EMPTY_RESULT = FrameResult(0, 0.0, 0.0, (), (), (), (), (), (), (), 0.0, 0.0)  # 还没有任何结果时使用
+
+
+def motion_energy(frame, last_small, size=(160, 90)):
+    """ 计算缩小后灰度图与上一帧的平均帧差 (0~1), 返回 (运动量, 本帧缩小图) """
+
+    small = cv2.cvtColor(cv2.resize(frame, size, interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+
+    if last_small is None:
+        return 0.0, small
+
+    return cv2.mean(cv2.absdiff(small, last_small))[0] / 255, small
+
+
+class LatestQueue:
+    """ 连接流水线各阶段的有界队列: drop=True 时满了丢弃最旧的一项 (实时画面只要最新帧), 否则阻塞等待 (回放不丢帧) """
+
+    def __init__(self, maxsize=1, drop=True):
+        self.maxsize = maxsize
+        self.drop = drop
+        self.items = collections.deque()
+        self.cond = threading.Condition()
+        self.closed = False
+        self.dropped = 0
+
+    def put(self, item):
+        """ 放入一项, 返回因此丢弃的项数 """
+        with self.cond:
+            dropped = 0
+            if self.drop:
+                while len(self.items) >= self.maxsize:
+                    self.items.popleft()
+                    dropped += 1
+            else:
+                self.cond.wait_for(lambda: len(self.items) < self.maxsize or self.closed)
+
+            if self.closed:
+                return dropped
+
+            self.items.append(item)
+            self.dropped += dropped
+            self.cond.notify_all()
+            return dropped
+
+    def get(self, timeout=None):
+        """ 取出最旧的一项, 超时或队列已关闭且为空时返回 None """
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.items or self.closed, timeout):
+                return None
+            if not self.items:
+                return None
+
+            item = self.items.popleft()
+            self.cond.notify_all()
+            return item
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+
+class Snapshot:
+    """ 一次性的观看者, 收到下一张标注图像后拷贝保存 """
+
+    def __init__(self, name='img_chess'):
+        self.name = name
+        self.img = None
+        self.event = threading.Event()
+
+    def show(self, name, img):
+        if name == self.name and not self.event.is_set():
+            self.img = img.copy()  # 绘图缓冲区会被下一帧复用
+            self.event.set()
+
+
 class USBCamera:
-    def __init__(self):
-        # 获取相机参数
-        self.fps = camera_params.get('fps', 60)
-        self.camera_id = camera_params.get('camera_id', 0)
-        self.image_width = camera_params.get('image_width', 1280)
-        self.image_height = camera_params.get('image_height', 720)
-        self.auto_exposure = camera_params.get('auto_exposure', 1)
-        self.exposure_time = camera_params.get('exposure_time', 100)
-        self.gain = camera_params.get('gain', 0)
-        self.auto_wb = camera_params.get('auto_wb', 0)
-        self.wb_temperature = camera_params.get('wb_temperature', 5000)
-        self.contrast = camera_params.get('contrast', 27)
-
-        # 初始化相机
-        print(f'开始初始化 {self.camera_id} 号相机相机...')
-        self.cap = cv2.VideoCapture(self.camera_id)
-        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)  # 设置缓冲区大小为 1, 只读取最新一帧
-
-        print(f'初始化了 {self.camera_id} 号相机, 开始设置参数...')
-        self.set_camera_parameters() # 设置相机参数
-
-        # 注册需要暴露的数据
-        self.board_chess_colors = []
-        self.center_points = []
-        self.black_coords = []
-        self.white_coords = []
+    """ 视觉流水线: 抓帧线程只保留最新一帧 -> 处理线程 (cam_thread) 识别并发布结果 -> 显示线程绘制调试图像
+
+    各阶段之间用长度为 1 的队列连接, 实时来源处理不过来时丢弃旧帧, 回放来源则逐帧处理.
+    OpenCV 和 pupil_apriltags 在计算时会释放 GIL, 抓帧/显示与识别可以并行.
+
+    只有存在观看者 (调试窗口, add_viewer 注册的对象, snapshot 请求) 时才绘制调试图像,
+    观看者实现 show(name, img), 图像是复用的缓冲区, 需要保留时自行拷贝.
+    """
+
+    def __init__(self, sink=None, grid_size=3, source=None, stats_path=None, stats_interval=5.0, scheduler=None,
+                 preview_port=None):
+        # 帧来源, 默认为 USB 摄像头, 也可以是视频文件/图片文件夹等回放来源
+        self.source = source if source is not None else create_source()
+
+        # 调试输出, 默认有图形界面时用窗口, 否则什么都不做
+        self.sink = sink if sink is not None else debug_sink.create_sink()
+        self.debug_images = debug_sink.DeferredSink(self.sink)  # 识别线程中的中间调试图像, 由显示线程输出
+        debug_sink.set_sink(self.debug_images)
+
+        # 调试图像的观看者, 没有观看者时不绘制; 所有标注画在同一块复用的缓冲区上
+        self.viewers = []
+        self._viewers_lock = threading.Lock()
+        self._canvas = None
+        if self.sink.enabled:
+            self.viewers.append(self.sink)
+
+        # 无界面设备上的 HTTP 预览 (MJPEG 和 JSON), 设置了端口 (或环境变量 VISION_PREVIEW_PORT) 时启动
+        if preview_port is None and os.environ.get('VISION_PREVIEW_PORT'):
+            preview_port = int(os.environ['VISION_PREVIEW_PORT'])
+        self.preview = PreviewServer(self, preview_port) if preview_port is not None else None  # 0 表示自动分配端口
+
+        # 分阶段计时, 设置了 stats_path (或环境变量 VISION_STATS) 时定期写入文件, .prom 结尾为 Prometheus 格式
+        self.timer = StageTimer()
+        self.stats_path = stats_path or os.environ.get('VISION_STATS')
+        self.stats_interval = stats_interval
+        self._last_dump = 0.0
+        self._last_capture = None  # 上一帧的拍摄时间, 用于估计丢帧
+
+        self.grid_size = grid_size            # 棋盘每边的格数
+        self.tag_tracker = tags.TagTracker(timer=self.timer)  # 底板标记跟踪
+        self.warper = tags.BoardWarper()      # 底板透视变换
+
+        # 注册需要暴露的数据, 每帧整体替换
+        self._result = EMPTY_RESULT
+        self._result_cond = threading.Condition()
+        self.frame_id = 0
+        self._last_small = None  # 上一帧缩小图, 用于计算运动量
+        self.color_filter = chess.BoardColorFilter(grid_size * grid_size)  # 棋盘格颜色时间滤波
+
+        # 按对局状态调节抓帧频率 (只对实时来源生效), 与运动模块共用
+        self.scheduler = scheduler if scheduler is not None else get_scheduler()
+
+        # 流水线各阶段, 实时来源只处理最新帧, 回放来源不丢帧
+        self.running = False
+        self.frame_queue = LatestQueue(1, drop=self.source.live)   # 抓帧 -> 处理
+        self.render_queue = LatestQueue(1, drop=True)              # 处理 -> 显示, 显示跟不上时只画最新的
+        self.grab_thread = threading.Thread(target=self.grab_loop, daemon=True)
+        self.render_thread = threading.Thread(target=self.render_loop, daemon=True)
 
         # print('启动USB相机图像捕捉循环')
         self.cam_thread = threading.Thread(target=self.loop)
         # self.cam_thread.start()
 
-    def set_camera_parameters(self):
-        self.cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc('M', 'J', 'P', 'G'))
-        self.cap.set(cv2.CAP_PROP_FPS, self.fps)
-        self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.image_width)
-        self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.image_height)
-        self.cap.set(cv2.CAP_PROP_AUTO_EXPOSURE, self.auto_exposure)
-        self.cap.set(cv2.CAP_PROP_EXPOSURE, self.exposure_time)
-        self.cap.set(cv2.CAP_PROP_GAIN, self.gain)
-        self.cap.set(cv2.CAP_PROP_AUTO_WB, self.auto_wb)  # 关闭自动白平衡
-        self.cap.set(cv2.CAP_PROP_WB_TEMPERATURE, self.wb_temperature)  # 设置白平衡色温
-        self.cap.set(cv2.CAP_PROP_CONTRAST, self.contrast)
+    def process_frame(self, frame, capture_time=None, draw=True):
+        """ 在当前线程中处理一帧, 返回 (结果, 调试图像); draw=False 时不绘制, 调试图像为 None """
+        result, scene = self.detect(frame, capture_time)
+        return result, self.draw_scene(scene) if draw else None
 
+    def detect(self, frame, capture_time=None, grabbed=None):
+        """ 处理一帧: 底板标记 -> 透视变换 -> 棋盘格 -> 棋子, 发布结果, 返回 (结果, 绘图所需数据)
 
-        print(f"设置的相机: {self.camera_id} 号相机")
-        print(f"设置的分辨率: {self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)} x {self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)}")
-        print(f"设置的帧率: {self.cap.get(cv2.CAP_PROP_FPS)}")
+        grabbed 为抓帧时的 time.perf_counter(), 用于计算端到端延迟
+        """
 
-    def loop(self):
-        print("进入 loop 线程")
+        capture_start = time.perf_counter()
+        if capture_time is None:
+            capture_time = time.time()
+        if grabbed is None:
+            grabbed = capture_start
+
+        timer = self.timer
+
+        with timer.stage('motion'):
+            motion, self._last_small = motion_energy(frame, self._last_small)  # 画面运动量
+        
+        with timer.stage('tags'):
+            quad_vertices, detections = self.tag_tracker.update(frame)  # 获取四个角点, 底板不动时不重新检测
+
+        with timer.stage('warp'):
+            if quad_vertices is not None and len(quad_vertices) >= 4:
+                H_matrix = self.warper.update(quad_vertices)  # 透视变换, 角点不动时复用矩阵和查找表
+                img_trans = self.warper.warp(frame)           # 只做正向变换, 反向变换按需用 warper.inverse_warp
+
+            else:
+                H_matrix = None
+                detections = ()  # 没有找到底板时不画 tag
+                img_trans = frame
+
+        with timer.stage('segment'):
+            _, mask = chess.segment_frame(img_trans)  # 每帧只做一次 模糊/HSV/掩膜, 两个检测共用
+
+        with timer.stage('board'):
+            corners, center_points, board_chess_colors = chess.chess_board_detect(img_trans, mask=mask, n=self.grid_size)  # 获取棋盘格信息
+        with timer.stage('pieces'):
+            black_coords, white_coords, black_contours, white_contours = chess.chess_detect(img_trans, mask=mask)          # 获取棋子位置
+
+        raw_board_chess_colors = board_chess_colors
+        if len(raw_board_chess_colors) > 0:  # 多帧投票, 过滤阴影和反光造成的单帧误判
+            board_chess_colors, board_confidence = self.color_filter.update(raw_board_chess_colors)
+        else:
+            board_confidence = []
+
+        self.frame_id += 1
+        result = FrameResult(
+            frame_id=self.frame_id,
+            timestamp=capture_time,
+            latency=time.perf_counter() - capture_start,
+            corners=tuple(corners),
+            center_points=tuple(center_points),
+            board_chess_colors=tuple(board_chess_colors),
+            board_confidence=tuple(board_confidence),
+            raw_board_chess_colors=tuple(raw_board_chess_colors),
+            black_coords=tuple(black_coords),
+            white_coords=tuple(white_coords),
+            motion=motion,
+            end_to_end=time.perf_counter() - grabbed,
+        )
+        self._publish(result)
+        timer.record('process', result.latency)
+        timer.record('end_to_end', result.end_to_end)
+        timer.frame_done()
+
+        scene = (img_trans, detections, H_matrix, corners, center_points, board_chess_colors, black_contours, white_contours)
+        return result, scene
+
+    def draw_scene(self, scene):
+        """ 在复用的缓冲区上画出 tag, 棋盘格和棋子, 返回的图像会被下一次绘制覆盖 """
+        img_trans, detections, H_matrix, corners, center_points, board_chess_colors, black_contours, white_contours = scene
+
+        with self.timer.stage('draw'):
+            canvas = self._canvas
+            if canvas is None or canvas.shape != img_trans.shape:
+                canvas = self._canvas = img_trans.copy()
+            else:
+                np.copyto(canvas, img_trans)
+
+            tags.draw_tags(canvas, detections, inplace=True, H_matrix=H_matrix)
+            chess.draw_chess_board(canvas, corners, center_points, board_chess_colors, inplace=True)
+            chess.draw_chess(canvas, black_contours, (255, 100, 0), inplace=True)
+            chess.draw_chess(canvas, white_contours, (0, 100, 255), inplace=True)
+
+        return canvas
+
+    def add_viewer(self, viewer):
+        """ 注册观看者, 之后每帧都会绘制调试图像并调用 viewer.show(name, img) """
+        with self._viewers_lock:
+            if viewer not in self.viewers:
+                self.viewers.append(viewer)
+
+    def remove_viewer(self, viewer):
+        with self._viewers_lock:
+            if viewer in self.viewers:
+                self.viewers.remove(viewer)
+
+    def has_viewers(self):
+        return len(self.viewers) > 0
+
+    def snapshot(self, timeout=2.0):
+        """ 取下一帧的标注图像 (拷贝), 没有其他观看者时也只为这一次请求绘制; 超时返回 None """
+        request = Snapshot()
+        self.add_viewer(request)
+        self.wake(timeout)  # 空闲降频时也能尽快拿到
+        try:
+            request.event.wait(timeout)
+        finally:
+            self.remove_viewer(request)
+        return request.img
+
+    def grab_loop(self):
+        """ 抓帧线程: 不停读取来源, 队列里只保留最新一帧 """
 
         cnt = 0
-        while not self.cap.isOpened():
+        while self.running and not self.source.open():
             cnt += 1
             print(f"摄像头打开失败，请检查摄像头是否正常连接！{cnt}")
-            
-            self.cap = cv2.VideoCapture(self.camera_id)
-            self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)  # 设置缓冲区大小为 1, 只读取最新一帧
+
+            if not self.source.live:  # 回放来源打不开就不再重试
+                self.frame_queue.close()
+                return
 
             time.sleep(0.5)
             continue
 
-        while True:
-            ret, frame = self.cap.read()
-            
-            img_pre = tags.pre_process(frame)       # 预处理
-            detections = tags.detect_tags(img_pre)  # 检测标记
+        last_grab = 0.0
+        while self.running:
+            waited = False
+            if self.source.live:  # 空闲时降低帧率, 机械臂运动时暂停
+                ready, waited = self.scheduler.wait_turn(last_grab)
+                if not ready:
+                    continue
+                if waited:
+                    self.source.flush()  # 等待期间缓冲的旧帧已经过时
+            last_grab = time.perf_counter()
+
+            with self.timer.stage('read'):
+                ret, frame, capture_time = self.source.read()
+
+            if not ret:
+                if self.source.finished:  # 回放结束
+                    break
+                time.sleep(0.01)
+                continue
+
+            if waited:  # 主动跳过的帧不算丢帧
+                self._last_capture = capture_time
+            else:
+                self._count_dropped(capture_time)
+            self.timer.count_dropped(self.frame_queue.put((frame, capture_time, time.perf_counter())))
 
-            quad_vertices = tags.tags_to_quad_vertices(detections)  # 获取四个角点
+        self.frame_queue.close()  # 通知处理线程没有更多帧了
 
-            if quad_vertices is not None and len(quad_vertices) >= 4:
+    def render_loop(self):
+        """ 显示线程: 画调试图像并交给所有观看者, 窗口按 q 时停止整个流水线 """
 
-                img_tags = tags.draw_tags(frame, detections)      # 绘制tag检测结果
+        while True:
+            item = self.render_queue.get(timeout=0.5)
+            if item is None:
+                if self.render_queue.closed:
+                    break
+                continue
+
+            frame, scene = item
+            with self._viewers_lock:
+                viewers = list(self.viewers)
+            if not viewers:  # 排队期间观看者已经离开
+                continue
+
+            img_chess = self.draw_scene(scene)
+
+            for viewer in viewers:
+                viewer.show("raw", frame)
+                viewer.show("img_chess", img_chess)
+            self.debug_images.flush()  # HighGUI 只在这个线程中调用
+
+            # self.sink.show("Inv Warped Image", self.warper.inverse_warp(img_chess, frame.shape))
+
+            if self.sink.enabled and self.sink.poll_key() == ord('q'):
+                self.stop()
+                break
+
+    def _start_stages(self):
+        """ 启动抓帧和显示线程, 已经启动时什么都不做 """
+        if self.running:
+            return
+
+        self.running = True
+        self.grab_thread.start()
+        self.render_thread.start()  # 没有观看者时一直阻塞在队列上, 不占用资源
+        if self.preview is not None:
+            self.preview.start()
 
-                H_matrix, H_inv = tags.homo_trans(quad_vertices)  # 透视变换
-                img_trans, img_retrans = tags.draw_homo_trans(img_tags, H_matrix)  # 绘制透视变换
+    def loop(self):
+        """ 处理线程: 从抓帧队列取最新一帧识别并发布结果 """
+        print("进入 loop 线程")
 
-            else:
-                img_tags = frame
-                img_trans = frame
-                img_retrans = frame
+        self._start_stages()
 
-            if img_trans is not None:
+        while True:
+            item = self.frame_queue.get(timeout=0.5)
+            if item is None:
+                if self.frame_queue.closed or not self.running:  # 来源结束或已停止
+                    break
+                continue
 
-                corners, self.center_points, self.board_chess_colors = chess.chess_board_detect(img_trans)            # 获取棋盘格信息
-                self.black_coords, self.white_coords, black_contours, white_contours = chess.chess_detect(img_trans)  # 获取棋子位置
+            frame, capture_time, grabbed = item
+            self.timer.record('queue_wait', time.perf_counter() - grabbed)
 
-                if corners is not None:  # 画出棋盘格
-                    img_chess = chess.draw_chess_board(img_trans, corners, self.center_points, self.board_chess_colors)
-                    img_chess = chess.draw_chess(img_chess, black_contours, (255, 100, 0))
-                    img_chess = chess.draw_chess(img_chess, white_contours, (0, 100, 255))
+            result, scene = self.detect(frame, capture_time, grabbed)
 
-            if ret:
-                if os.environ.get('DISPLAY') and os.isatty(0):  # 检查有无图形界面
-                # if os.isatty(0):
-                    cv2.namedWindow("raw", cv2.WINDOW_NORMAL)
-                    cv2.imshow("raw", frame)
+            if self.has_viewers():  # 没人看时不绘制
+                self.render_queue.put((frame, scene))
 
-                    cv2.namedWindow("img_chess", cv2.WINDOW_NORMAL)
-                    cv2.imshow("img_chess", img_chess)
+            dt = time_diff()         
 
-                    # cv2.namedWindow("img_tags", cv2.WINDOW_NORMAL)
-                    # cv2.imshow("img_tags", img_tags)
+            # print(f"图像大小: {frame.shape}, 帧率 FPS: {(1 / (dt/1e9)):.2f}, 帧时间: {(dt/1e6):.2f}") 
 
-                    # cv2.namedWindow("Warped Image", cv2.WINDOW_NORMAL)
-                    # cv2.imshow("Warped Image", img_trans)
+            self._dump_stats()
 
-                    # cv2.namedWindow("Inv Warped Image", cv2.WINDOW_NORMAL)
-                    # cv2.imshow("Inv Warped Image", img_retrans)
-                
-                    if cv2.waitKey(1) & 0xFF == ord('q'):
-                        self.destroy()
-                        break 
+        self.render_queue.close()
+        print("结束了 loop 线程")
 
-                dt = time_diff()         
+    def wake(self, duration=None):
+        """ 需要马上拿到新结果时调用, 接下来一段时间内全速运行 """
+        self.scheduler.wake(duration)
 
-                # print(f"图像大小: {frame.shape}, 帧率 FPS: {(1 / (dt/1e9)):.2f}, 帧时间: {(dt/1e6):.2f}") 
-                
-            # time.sleep(0.001)
-            time.sleep(0.1)
+    def sleep(self):
+        """ 结果已经拿到, 提前结束 wake() 的全速运行 """
+        self.scheduler.sleep()
 
-        print("结束了 loop 线程")
+    def stop(self):
+        """ 通知所有阶段停止, 不等待 """
+        self.running = False
+        self.frame_queue.close()
+        self.render_queue.close()
 
     def destroy(self):
         print("结束摄像头线程")
 
-        if self.cam_thread.is_alive():
-            self.cam_thread.join()
-
-        if self.cap.isOpened():
-            self.cap.release()  # 释放摄像头资源
-
+        self.stop()
+
+        current = threading.current_thread()
+        for thread in (self.cam_thread, self.grab_thread, self.render_thread):
+            if thread.is_alive() and thread is not current:
+                thread.join()
+
+        if self.preview is not None:
+            self.preview.stop()
+        self.sink.close()
+        self.source.release()
+
+
+    def _count_dropped(self, capture_time):
+        """ 实时来源按拍摄间隔估计两帧之间没被处理的帧数 """
+        fps = getattr(self.source, 'fps', None)
+        if self.source.live and fps and self._last_capture is not None:
+            self.timer.count_dropped(round((capture_time - self._last_capture) * fps) - 1)
+        self._last_capture = capture_time
+
+    def _dump_stats(self):
+        now = time.perf_counter()
+        if self.stats_path and now - self._last_dump >= self.stats_interval:
+            self._last_dump = now
+            try:
+                self.timer.dump(self.stats_path)
+            except OSError as e:
+                print(f"写入视觉统计失败: {e!r}")
+
+    def get_stats(self):
+        """ 分阶段耗时 p50/p95/p99, 滚动帧率, 丢帧数, 以及标记跟踪的命中率 """
+        stats = self.timer.snapshot()
+        stats['tag_tracker'] = self.tag_tracker.get_stats()
+        stats['scheduler'] = self.scheduler.get_stats()
+        stats['viewers'] = len(self.viewers)
+        return stats
+
+    def metrics(self):
+        """ Prometheus 文本格式的统计 """
+        return self.timer.to_prometheus()
+
+    def get_state(self):
+        """ 最新一帧的结果和统计, 可直接写成 JSON """
+        return {'result': result_to_dict(self._result), 'stats': self.get_stats()}
 
     def start_loop_thread(self):  # 启动循环线程
         self.cam_thread.start()
 
+    def _publish(self, result):
+        """ 原子发布一帧结果, 并唤醒所有等待者 """
+        with self._result_cond:
+            self._result = result
+            self._result_cond.notify_all()
+
+    def get_result(self):
+        """ 获取最新一帧的完整结果 """
+        return self._result
+
+    def wait_for_result(self, newer_than=None, timeout=None):
+        """ 等待 frame_id 大于 newer_than 的结果, newer_than 默认为调用时的最新帧, 超时返回 None """
+
+        with self._result_cond:
+            if newer_than is None:
+                newer_than = self._result.frame_id
+
+            if not self._result_cond.wait_for(lambda: self._result.frame_id > newer_than, timeout):
+                print(f"等待新一帧结果超时 ({timeout} s)")
+                return None
+
+            return self._result
+
+    @property
+    def center_points(self):
+        return self._result.center_points
+
+    @property
+    def board_chess_colors(self):
+        return self._result.board_chess_colors
+
+    @property
+    def black_coords(self):
+        return self._result.black_coords
+
+    @property
+    def white_coords(self):
+        return self._result.white_coords
+
     def get_center_points(self):
         if self.cam_thread.is_alive():
             return self.center_points
@@ -205,6 +547,69 @@ class USBCamera:
             return None
 
 
+def result_to_dict(result):
+    """ 转换为可写入 JSON 的字典 """
+    return json.loads(json.dumps(result._asdict(), default=lambda o: o.item() if hasattr(o, 'item') else str(o)))
+
+
+def replay(source, grid_size=3, output=None, sink=None):
+    """ 在当前线程中处理来源的每一帧 (不丢帧), 可把每帧结果写入 jsonl, 返回结果列表 """
+
+    camera = USBCamera(sink=sink or debug_sink.NullSink(), grid_size=grid_size, source=source)
+    results = []
+    start = time.perf_counter()
+
+    out_file = open(output, 'w') if output else None
+    try:
+        for frame, timestamp in source:
+            result, img_chess = camera.process_frame(frame, timestamp, draw=camera.sink.enabled)
+            results.append(result)
+
+            if out_file:
+                out_file.write(json.dumps(result_to_dict(result), ensure_ascii=False) + '\n')
+
+            if camera.sink.enabled:
+                camera.sink.show("raw", frame)
+                camera.sink.show("img_chess", img_chess)
+                camera.debug_images.flush()
+                if camera.sink.poll_key() == ord('q'):
+                    break
+    finally:
+        if out_file:
+            out_file.close()
+        camera.sink.close()
+        source.release()
+
+    elapsed = time.perf_counter() - start
+    if results:
+        latencies = sorted(r.latency for r in results)
+        print(f"共处理 {len(results)} 帧, 用时 {elapsed:.2f} s, 平均 {len(results) / elapsed:.1f} FPS, "
+              f"处理耗时 中位数 {latencies[len(latencies) // 2] * 1000:.1f} ms, 最大 {latencies[-1] * 1000:.1f} ms")
+    else:
+        print("没有处理任何帧")
+
+    print(camera.timer.summary())
+    return results
+
+
 if __name__ == '__main__':
-    camera = USBCamera()
-    camera.loop()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="运行视觉流水线, 不指定来源时使用摄像头")
+    parser.add_argument('--video', help="回放视频文件")
+    parser.add_argument('--images', help="回放图片文件夹")
+    parser.add_argument('--fps', type=float, default=10.0, help="图片文件夹回放的帧率")
+    parser.add_argument('--realtime', action='store_true', help="按原始时间戳的节奏回放, 默认尽快处理")
+    parser.add_argument('--speed', type=float, default=1.0, help="实时回放的倍速")
+    parser.add_argument('--loop', action='store_true', help="循环回放")
+    parser.add_argument('--grid', type=int, default=3, help="棋盘每边的格数")
+    parser.add_argument('--output', help="把每帧结果写入 jsonl 文件")
+    parser.add_argument('--sink', help="调试输出: none / window / disk / ring, 默认自动选择")
+    parser.add_argument('--preview', type=int, help="摄像头模式下在该端口启动 HTTP 调试预览")
+    args = parser.parse_args()
+
+    if args.video or args.images:
+        source = create_source(args.video, args.images, args.realtime, args.speed, args.loop, args.fps)
+        sink = debug_sink.create_sink(args.sink) if args.sink else None
+        replay(source, args.grid, args.output, sink)
+    else:
+        camera = USBCamera(grid_size=args.grid, preview_port=args.preview)
+        camera.loop()
\ No newline at end of file
@@ -1,14 +1,16 @@
 import cv2
 import numpy as np
 
+import debug_sink
+from tags import transform_points
 from colors import GREEN_LOWER, GREEN_UPPER, YELLOW_LOWER, YELLOW_UPPER
 
 
-def remove_background(img, lower, upper):
+def segment_frame(img, lower=YELLOW_LOWER, upper=YELLOW_UPPER):
+    """ 单次计算 模糊后的 HSV 图像 和 背景掩膜, 供棋盘与棋子检测共用 """
 
     img_blur = cv2.GaussianBlur(img, (15, 15), 0)
-    cv2.namedWindow('img_blur', cv2.WINDOW_NORMAL)
-    cv2.imshow('img_blur', img_blur)
+    debug_sink.show('img_blur', img_blur)
     
     hsv_img = cv2.cvtColor(img_blur, cv2.COLOR_BGR2HSV)  # 转换为HSV格式
 
@@ -23,18 +25,25 @@ def remove_background(img, lower, upper):
  
     cv2.bitwise_not(mask, mask)  # 翻转掩膜 
 
+    return hsv_img, mask
+
+
+def remove_background(img, lower, upper):
+
+    _, mask = segment_frame(img, lower, upper)
+
     return mask
 
 
-def detect_chess_contours(img):
-    """ 从背景识别棋子轮廓 """
+def detect_chess_contours(img, mask_yellow=None):
+    """ 从背景识别棋子轮廓, mask_yellow 为 segment_frame 已算好的掩膜 """
 
-    mask_yellow = remove_background(img, YELLOW_LOWER, YELLOW_UPPER)  # 移除黄色背景
+    if mask_yellow is None:
+        mask_yellow = remove_background(img, YELLOW_LOWER, YELLOW_UPPER)  # 移除黄色背景
     # mask_green  = remove_background(img,  GREEN_LOWER,  GREEN_UPPER)
     # mask = mask_yellow & mask_green
 
-    cv2.namedWindow('Mask', cv2.WINDOW_NORMAL)   # 显示掩膜
-    cv2.imshow('Mask', mask_yellow)
+    debug_sink.show('Mask', mask_yellow)  # 显示掩膜
 
     contours, _ = cv2.findContours(mask_yellow, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)  # 查找轮廓
     
@@ -70,23 +79,34 @@ def detect_chess_contours(img):
     return filtered_contours      
 
 
-def classify_background_chess_color(img, contours):
-    """ 根据轮廓颜色分类棋子 """
+def contours_mean_colors(img, contours):
+    """ 计算每个轮廓内部的平均颜色, 只在轮廓外接矩形内建局部掩膜, 返回 (N, 3) 数组 """
 
-    black_contours = []
-    white_contours = []
+    mean_colors = np.zeros((len(contours), 3), dtype=np.float64)
 
-    for contour in contours:
-        # 计算轮廓的平均颜色
-        mask = np.zeros(img.shape[:2], dtype=np.uint8)
-        cv2.drawContours(mask, [contour], -1, 255, -1)  # 填充轮廓以获取颜色
-        mean_val = cv2.mean(img, mask=mask)  # 计算平均色彩
+    for i, contour in enumerate(contours):
+        x, y, w, h = cv2.boundingRect(contour)
+        mask = np.zeros((h, w), dtype=np.uint8)
+        cv2.drawContours(mask, [contour], -1, 255, -1, offset=(-x, -y))  # 在局部掩膜上填充轮廓
+        mean_colors[i] = cv2.mean(img[y:y+h, x:x+w], mask=mask)[:3]     # 计算平均色彩
+
+    return mean_colors
 
-        # 判断颜色是否接近黑色或白色
-        if mean_val[0] < 100 and mean_val[1] < 100 and mean_val[2] < 100:  # 接近黑色
-            black_contours.append(contour)
-        elif mean_val[0] > 150 and mean_val[1] > 150 and mean_val[2] > 150:  # 接近白色
-            white_contours.append(contour)
+
+def classify_background_chess_color(img, contours, return_colors=False):
+    """ 根据轮廓颜色分类棋子, return_colors 为 True 时额外返回每个轮廓的平均颜色, 方便核对阈值 """
+
+    mean_colors = contours_mean_colors(img, contours)
+
+    # 判断颜色是否接近黑色或白色
+    is_black = np.all(mean_colors < 100, axis=1)  # 接近黑色
+    is_white = np.all(mean_colors > 150, axis=1)  # 接近白色
+
+    black_contours = [contour for contour, flag in zip(contours, is_black) if flag]
+    white_contours = [contour for contour, flag in zip(contours, is_white) if flag]
+
+    if return_colors:
+        return black_contours, white_contours, mean_colors
 
     return black_contours, white_contours
 
@@ -106,10 +126,10 @@ def contours_to_positom(contours):
     return contours_positions
 
 
-def draw_chess(img, contours, color):
-    """ 在图像上绘制棋子轮廓 """
+def draw_chess(img, contours, color, inplace=False):
+    """ 在图像上绘制棋子轮廓, inplace=True 时直接画在 img 上 """
 
-    img_chess = img.copy()
+    img_chess = img if inplace else img.copy()
 
     for contour in contours:
         cv2.drawContours(img_chess, [contour], -1, color, 8)
@@ -122,16 +142,15 @@ def draw_chess(img, contours, color):
     return img_chess
 
 
-def chess_detect(img, debug=False):
+def chess_detect(img, debug=False, mask=None):
     """ 从背景识别棋子位置 """
 
-    chess_contours = detect_chess_contours(img)  # 获取所有棋子轮廓
+    chess_contours = detect_chess_contours(img, mask)  # 获取所有棋子轮廓
 
     if len(chess_contours) == 0:  # 如果没有找到任何棋子轮廓，则返回空列表
        
         if debug:  # 调试模式
-            cv2.namedWindow("img_chess", cv2.WINDOW_NORMAL)
-            cv2.imshow("img_chess", img)
+            debug_sink.show("img_chess", img)
 
         return [], [], [], []
     
@@ -142,11 +161,10 @@ def chess_detect(img, debug=False):
     # print(f"黑色棋子数量: {len(black_coords)}, 位置: {black_coords}")
     # print(f"白色棋子数量: {len(white_coords)}, 位置: {white_coords}")
  
-    if debug:  # 调试模式
+    if debug and debug_sink.enabled():  # 调试模式, 没有调试输出时不绘制
         img_chess = draw_chess(img, black_contours, (255, 100, 0))
-        img_chess = draw_chess(img_chess, white_contours, (0, 100, 255))
-        cv2.namedWindow("img_chess", cv2.WINDOW_NORMAL)
-        cv2.imshow("img_chess", img_chess)
+        draw_chess(img_chess, white_contours, (0, 100, 255), inplace=True)
+        debug_sink.show("img_chess", img_chess)
 
     return black_coords, white_coords, black_contours, white_contours
 
@@ -170,8 +188,8 @@ def sort_corners(corners):
     return corners
 
 
-def detect_board_corners(img):
-    """ 从背景识别棋盘角点 """
+def detect_board_corners(img, mask_yellow=None):
+    """ 从背景识别棋盘角点, mask_yellow 为 segment_frame 已算好的掩膜 """
     
     # blurred_img = cv2.GaussianBlur(img, (7, 7), 0)
     # opened_img = cv2.morphologyEx(blurred_img, cv2.MORPH_OPEN, np.ones((5, 5), np.uint8))
@@ -181,7 +199,8 @@ def detect_board_corners(img):
     # cv2.imshow('edges', edges)
 
     
-    mask_yellow = remove_background(img, YELLOW_LOWER, YELLOW_UPPER)  # 移除黄色背景
+    if mask_yellow is None:
+        mask_yellow = remove_background(img, YELLOW_LOWER, YELLOW_UPPER)  # 移除黄色背景
     # mask_green  = remove_background(img,  GREEN_LOWER,  GREEN_UPPER)
     # mask = mask_yellow & mask_green
 
@@ -238,24 +257,33 @@ def homo_trans(corners, w=300, h=300):
 
 def trans_coord(point, matrix):
     """ 输入一个坐标，输出经过矩阵变换后的坐标 """
-    point_homogeneous = np.array([point[0], point[1], 1])
-    transformed_point = matrix @ point_homogeneous
-    return int(transformed_point[0] / transformed_point[2]), \
-           int(transformed_point[1] / transformed_point[2])
+    x, y = transform_points([point], matrix)[0]
+    return int(x), int(y)
+
+
+_grid_templates = {}  # 每种尺寸只计算一次
+
+
+def grid_template(n=3):
+    """ n x n 棋盘格中心点在单位正方形中的位置, 按行排列 """
+
+    if n not in _grid_templates:
+        centers = (np.arange(n) * 2 + 1) / (2 * n)
+        xs, ys = np.meshgrid(centers, centers)
+        _grid_templates[n] = np.stack([xs.ravel(), ys.ravel()], axis=1)
+    return _grid_templates[n]
 
 
-def get_center_points(H_inv, w=300, h=300):
+GRID_TEMPLATE = grid_template(3)
+
+
+def get_center_points(H_inv, w=300, h=300, n=3):
     """ 获取棋盘格中心点坐标 """
-     
-    center_points = []
-    raw_points = [(1/6*w, 1/6*h), (3/6*w, 1/6*h), (5/6*w, 1/6*h), \
-                  (1/6*w, 3/6*h), (3/6*w, 3/6*h), (5/6*w, 3/6*h), \
-                  (1/6*w, 5/6*h), (3/6*w, 5/6*h), (5/6*w, 5/6*h)]
-    
-    for point in raw_points:
-        transformed_point = trans_coord(point, H_inv)
-        #  print(f"原始点: {point}, 变换后点: {transformed_point}")
-        center_points.append(transformed_point)
+
+    raw_points = grid_template(n) * (w, h)
+    transformed_points = transform_points(raw_points, H_inv).astype(int)  # 与 int() 一样向零取整
+
+    center_points = [(int(x), int(y)) for x, y in transformed_points]
 
     # print("棋盘网格的中心点:", center_points)
     return center_points
@@ -279,13 +307,13 @@ def get_point_color(img, center_point, radius):
 
     return average_color
 
-def classify_board_chess_color(img, center_points):
+def classify_board_chess_color(img, center_points, radius=20):
     """ 获取棋盘格上棋子的颜色 """
 
     board_chess_colors = []
 
     for point in center_points:
-        color = get_point_color(img, point, 20)
+        color = get_point_color(img, point, radius)
 
         # 判断颜色
         # if color > (200, 200, 200):  # 白色棋子
@@ -311,10 +339,55 @@ def classify_board_chess_color(img, center_points):
     return board_chess_colors
 
 
-def draw_chess_board(img, corners, center_points, chess_colors):
-    """ 绘制棋盘格调试信息 """
+class BoardColorFilter:
+    """ 棋盘格颜色的时间投票滤波: 每格取最近 window 帧的多数结果, 票数不过半时保持原结果 """
+
+    VALUES = np.array([-1, 0, 1], dtype=np.int8)  # 黑, 无, 白
+
+    def __init__(self, n_cells=9, window=5):
+        self.n_cells = n_cells
+        self.window = window
+
+        self.history = np.zeros((window, n_cells), dtype=np.int8)  # 环形缓冲区
+        self.index = 0
+        self.count = 0
+
+        self.state = np.zeros(n_cells, dtype=np.int8)       # 滤波后的颜色
+        self.confidence = np.zeros(n_cells)  # 当前颜色在窗口中的得票率
+
+    def update(self, board_chess_colors):
+        """ 输入单帧识别结果, 返回 (滤波后颜色列表, 每格置信度列表) """
+
+        if len(board_chess_colors) != self.n_cells:  # 本帧没有识别到棋盘, 不参与投票
+            return self.state.tolist(), self.confidence.tolist()
+
+        self.history[self.index] = board_chess_colors
+        self.index = (self.index + 1) % self.window
+        self.count = min(self.count + 1, self.window)
+
+        history = self.history[:self.count]
+        votes = (history[:, :, None] == self.VALUES).sum(axis=0)  # (n_cells, 3) 每格每种颜色的票数
+
+        winner = votes.argmax(axis=1)
+        majority = votes[np.arange(self.n_cells), winner] * 2 > self.count  # 过半才切换
+        self.state[majority] = self.VALUES[winner[majority]]
+
+        state_votes = votes[np.arange(self.n_cells), np.searchsorted(self.VALUES, self.state)]
+        self.confidence = state_votes / self.count
+
+        return self.state.tolist(), self.confidence.tolist()
+
+    def reset(self):
+        self.index = 0
+        self.count = 0
+        self.state[:] = 0
+        self.confidence[:] = 0
+
+
+def draw_chess_board(img, corners, center_points, chess_colors, inplace=False):
+    """ 绘制棋盘格调试信息, inplace=True 时直接画在 img 上 """
     
-    draw_img = img.copy()
+    draw_img = img if inplace else img.copy()
 
     if corners:
         for i in range(len(corners)):  # 绘制棋盘顶点和连线   
@@ -342,17 +415,16 @@ def draw_chess_board(img, corners, center_points, chess_colors):
     return draw_img
 
 
-def chess_board_detect(img, debug=False):
-    """ 棋盘格识别总函数 """
+def chess_board_detect(img, debug=False, mask=None, n=3):
+    """ 棋盘格识别总函数, n 为棋盘每边的格数 """
 
-    corners = detect_board_corners(img)  # 获取棋盘格角点
+    corners = detect_board_corners(img, mask)  # 获取棋盘格角点
 
     if len(corners) == 0:
         # print("没有检测到棋盘")
         
         if debug:  # 调试模式
-            cv2.namedWindow('img_board', cv2.WINDOW_NORMAL)
-            cv2.imshow('img_board', img)  # 绘制空白图像
+            debug_sink.show('img_board', img)  # 绘制空白图像
 
         return [], [], []
     
@@ -362,13 +434,12 @@ def chess_board_detect(img, debug=False):
         print("无法计算透视变换矩阵或其逆矩阵")
         return [], [], []
 
-    center_points = get_center_points(H_inv)  # 获取棋盘格中心点
-    board_chess_colors = classify_board_chess_color(img, center_points)
+    center_points = get_center_points(H_inv, n=n)  # 获取棋盘格中心点
+    board_chess_colors = classify_board_chess_color(img, center_points, radius=max(4, 60 // n))  # 格子越小采样半径越小
 
-    if debug:  # 调试模式
+    if debug and debug_sink.enabled():  # 调试模式, 没有调试输出时不绘制
         draw_img = draw_chess_board(img, corners, center_points, board_chess_colors)
-        cv2.namedWindow('img_board', cv2.WINDOW_NORMAL)
-        cv2.imshow('img_board', draw_img)
+        debug_sink.show('img_board', draw_img)
 
     return corners, center_points, board_chess_colors
 
@@ -376,17 +447,19 @@ def chess_board_detect(img, debug=False):
 if __name__ == '__main__':
 
     print("开始测试")
+    debug_sink.set_sink(debug_sink.WindowSink())  # 单张图片测试时用窗口显示调试图像
     # img_load = 'img/chessboard_y1.jpg'
     # img_load = 'img/chessboard_f2.jpg'
     img_load = 'img/tag_3.jpg'
     img_raw = cv2.imread(img_load)
 
-    cv2.namedWindow('img_raw', cv2.WINDOW_NORMAL)
-    cv2.imshow('img_raw', img_raw)
+    debug_sink.show('img_raw', img_raw)
     
-    center_points, chess_colors = chess_board_detect(img_raw, True)
+    _, mask = segment_frame(img_raw)  # 棋盘与棋子检测共用同一张掩膜
+
+    corners, center_points, chess_colors = chess_board_detect(img_raw, True, mask)
 
-    black_coords, white_coords, black_contours, white_contours = chess_detect(img_raw, True)
+    black_coords, white_coords, black_contours, white_contours = chess_detect(img_raw, True, mask)
 
     # cv2.namedWindow('Detected Circles and Chessboard Corners', cv2.WINDOW_NORMAL)
     # cv2.imshow('Detected Circles and Chessboard Corners', img0)
@@ -0,0 +1,164 @@
+import os
+import time
+import threading
+import collections
+
+import cv2
+
+
+class NullSink:
+    """ 空调试输出, 不做任何事情 (默认, 无界面设备上使用) """
+
+    enabled = False
+
+    def show(self, name, img):
+        pass
+
+    def poll_key(self):
+        return -1
+
+    def close(self):
+        pass
+
+
+class WindowSink(NullSink):
+    """ 用 HighGUI 窗口显示调试图像 """
+
+    enabled = True
+
+    def __init__(self):
+        self.windows = set()
+
+    def show(self, name, img):
+        if name not in self.windows:  # 窗口只创建一次
+            cv2.namedWindow(name, cv2.WINDOW_NORMAL)
+            self.windows.add(name)
+        cv2.imshow(name, img)
+
+    def poll_key(self):
+        return cv2.waitKey(1) & 0xFF
+
+    def close(self):
+        cv2.destroyAllWindows()
+        self.windows.clear()
+
+
+class DiskSink(NullSink):
+    """ 把调试图像写入磁盘, 每个名字至少间隔 min_interval 秒才写一次 """
+
+    enabled = True
+
+    def __init__(self, out_dir='output/debug', min_interval=1.0):
+        self.out_dir = out_dir
+        self.min_interval = min_interval
+        self.last_write = {}  # 每个名字上次写入的时间
+        os.makedirs(out_dir, exist_ok=True)
+
+    def show(self, name, img):
+        now = time.monotonic()
+        if now - self.last_write.get(name, -self.min_interval) < self.min_interval:
+            return  # 限速, 丢弃这一张
+
+        self.last_write[name] = now
+        file_name = f"{name}_{time.strftime('%Y%m%d_%H%M%S')}_{int(now * 1000) % 1000:03d}.png"
+        cv2.imwrite(os.path.join(self.out_dir, file_name), img)
+
+
+class RingSink(NullSink):
+    """ 在内存中保留最近 maxlen 张调试图像, 需要时再 dump 到磁盘 """
+
+    enabled = True
+
+    def __init__(self, maxlen=64):
+        self.frames = collections.deque(maxlen=maxlen)
+
+    def show(self, name, img):
+        self.frames.append((time.time(), name, img.copy()))  # 调用方可能复用缓冲区, 必须拷贝
+
+    def dump(self, out_dir='output/debug_dump'):
+        os.makedirs(out_dir, exist_ok=True)
+
+        frames = list(self.frames)
+        for i, (timestamp, name, img) in enumerate(frames):
+            file_name = f"{i:04d}_{name}_{timestamp:.3f}.png"
+            cv2.imwrite(os.path.join(out_dir, file_name), img)
+
+        print(f"已导出 {len(frames)} 张调试图像到 {out_dir}")
+        return len(frames)
+
+
+class DeferredSink(NullSink):
+    """ 包装另一个输出: show() 只把图像存起来 (每个名字保留最新一张), flush() 时才真正输出
+
+    识别线程里的中间调试图像 (掩膜, 二值图等) 通过它交给显示线程, HighGUI 只在显示线程中调用.
+    """
+
+    def __init__(self, sink):
+        self.sink = sink
+        self.enabled = sink.enabled
+        self.lock = threading.Lock()
+        self.pending = collections.OrderedDict()
+
+    def show(self, name, img):
+        with self.lock:
+            self.pending[name] = img  # 调试图像每次都是新生成的, 不需要拷贝
+
+    def flush(self):
+        """ 在显示线程中调用, 输出积攒的图像 """
+        with self.lock:
+            items = list(self.pending.items())
+            self.pending.clear()
+        for name, img in items:
+            self.sink.show(name, img)
+
+    def poll_key(self):
+        return self.sink.poll_key()
+
+    def close(self):
+        with self.lock:
+            self.pending.clear()
+
+
+def has_display():
+    """ 检查有无图形界面 """
+    return bool(os.environ.get('DISPLAY')) and os.isatty(0)
+
+
+def create_sink(kind=None):
+    """ 按名字创建调试输出: none / window / disk / ring, 为 None 时读取环境变量 DEBUG_SINK, 再按有无界面自动选择 """
+
+    kind = kind or os.environ.get('DEBUG_SINK') or ('window' if has_display() else 'none')
+
+    if kind == 'window':
+        return WindowSink()
+    elif kind == 'disk':
+        return DiskSink()
+    elif kind == 'ring':
+        return RingSink()
+    elif kind == 'none':
+        return NullSink()
+
+    raise ValueError(f"未知的调试输出类型: {kind}")
+
+
+_sink = NullSink()  # 全局调试输出, 默认不输出
+
+
+def set_sink(sink):
+    """ 设置整个视觉流程 (chess, tags, camera) 使用的调试输出 """
+    global _sink
+    _sink = sink if sink is not None else NullSink()
+
+
+def get_sink():
+    return _sink
+
+
+def enabled():
+    """ 热路径先判断这里, 关闭时连调试图像都不用生成 """
+    return _sink.enabled
+
+
+def show(name, img):
+    if _sink.enabled:
+        _sink.show(name, img)
@@ -0,0 +1,104 @@
+import re
+import math
+import time
+import threading
+import types
+
+
+class FakeBambuClient:
+    """ 模拟打印机, 接口与 bambu_connect.BambuClient 的发送和状态订阅部分一致
+
+    收到 G-code 后像真打印机一样马上回复 gcode_line (只表示收下了命令) 并上报 gcode_state=RUNNING,
+    按运动的距离和速度 (以及 G4 停顿) 模拟执行队列, 队列执行完时上报 gcode_state=IDLE.
+    也可以用 replay() 按时间回放录制的状态消息. 用于在没有打印机时测试运动等待.
+    """
+
+    MOVE_PATTERN = re.compile(r'G0\s+X(?P<x>[-\d.]+)\s+Y(?P<y>[-\d.]+)\s+Z(?P<z>[-\d.]+)\s+F(?P<f>[\d.]+)')
+    DWELL_PATTERN = re.compile(r'G4\s+P(?P<ms>[\d.]+)')
+
+    def __init__(self, time_scale=1.0, ack_delay=0.02, ack=True, report=True):
+        self.time_scale = time_scale  # 模拟执行时间的缩放, 0 表示立即完成
+        self.ack_delay = ack_delay    # 网络延迟 s
+        self.ack = ack                # 为 False 时模拟不回复的打印机
+        self.report = report          # 为 False 时只回复 gcode_line, 不上报 gcode_state
+
+        self.sent = []                # 收到的 G-code
+        self.position = [250.0, 260.0, 15.0]
+        self.message_callback = None
+        self.busy_until = 0.0         # 模拟的运动队列结束时间
+        self.lock = threading.Lock()
+
+    def start_watch_client(self, message_callback=None, on_connect_callback=None):
+        self.message_callback = message_callback
+        if on_connect_callback:
+            on_connect_callback()
+
+    def stop_watch_client(self):
+        self.message_callback = None
+
+    def _duration(self, gcode):
+        """ 按每段 G0 的距离和速度, 加上 G4 停顿, 估算执行时间 """
+        duration = 0.0
+        for match in self.MOVE_PATTERN.finditer(gcode):
+            target = [float(match['x']), float(match['y']), float(match['z'])]
+            distance = math.dist(self.position, target)
+            duration += distance / (float(match['f']) / 60)
+            self.position = target
+        for match in self.DWELL_PATTERN.finditer(gcode):
+            duration += float(match['ms']) / 1000
+        return duration * self.time_scale
+
+    def send_gcode(self, gcode):
+        with self.lock:
+            self.sent.append(gcode)
+            now = time.monotonic()
+            self.busy_until = max(self.busy_until, now) + self._duration(gcode)  # 命令按顺序排队执行
+            finish_in = self.busy_until - now
+
+        if not self.ack:
+            return
+
+        self._later(self.ack_delay, self._emit, {'command': 'gcode_line', 'sequence_id': '2006', 'result': 'success'})
+        if self.report:
+            self._later(self.ack_delay, self._emit, {'gcode_state': 'RUNNING'})
+            self._later(finish_in + self.ack_delay, self._check_finished)  # 到时检查队列是否执行完
+
+    def _later(self, delay, function, *args):
+        timer = threading.Timer(delay, function, args)
+        timer.daemon = True
+        timer.start()
+
+    def _check_finished(self):
+        """ 队列中没有更晚的命令时上报空闲 """
+        with self.lock:
+            finished = time.monotonic() >= self.busy_until
+        if finished:
+            self._emit({'gcode_state': 'IDLE'})
+
+    def replay(self, messages, realtime=True):
+        """ 在后台线程中依次回放状态消息, messages 为 [(相对时间 s, print 字段字典), ...] """
+
+        def run():
+            start = time.monotonic()
+            for offset, message in messages:
+                if realtime:
+                    time.sleep(max(0.0, start + offset - time.monotonic()))
+                self._emit(message)
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    def _emit(self, message):
+        if self.message_callback:
+            self.message_callback(types.SimpleNamespace(**message))  # 与 PrinterStatus 一样按属性访问
+
+
+if __name__ == "__main__":
+    from robot import BambuRobot
+
+    robot = BambuRobot(reset=False, client_factory=lambda: FakeBambuClient(time_scale=0.1))
+
+    start = time.perf_counter()
+    robot.move_piece(100, 100, 50, 50)
+    print(f"模拟移动棋子耗时 {time.perf_counter() - start:.2f} s, 等待方式统计: {robot.motion_stats}")
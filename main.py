@@ -1,19 +1,26 @@
+import os
 import time
 import threading
-import subprocess
 
+import numpy as np
 from loguru import logger
 
 from camera import USBCamera
+from stabilizer import BoardStabilizer
 from robot import BambuRobot
-from ai import TicTacToeAI
+from ai import TicTacToeAI, print_board
+from pump import get_pump
 
-# 运行一个命令并等待其完成
-result = subprocess.run(['gpio', 'mode', '3', 'out'])
-result = subprocess.run(['gpio', 'write', '3', '1'])
+GRID_SIZE = int(os.environ.get('GRID_SIZE', 3))                    # 棋盘每边的格数
+WIN_LENGTH = int(os.environ.get('WIN_LENGTH', min(GRID_SIZE, 4)))  # 连成几子获胜, 默认 3x3 连三, 更大的棋盘连四
+GRID_CELLS = GRID_SIZE * GRID_SIZE
+CENTER_GRID = (GRID_SIZE // 2) * GRID_SIZE + GRID_SIZE // 2 + 1    # 中心方格的号码, 3x3 时为 5
 
-cam = USBCamera()
+get_pump()  # 初始化气泵 GPIO, 并关闭气泵
+
+cam = USBCamera(grid_size=GRID_SIZE)
 cam.start_loop_thread()  # 启动摄像头线程
+stabilizer = BoardStabilizer(cam, k=3, motion_threshold=0.02)  # 棋盘稳定检测
 
 bot = BambuRobot(reset=False)
 
@@ -45,18 +52,18 @@ class ChessBot:
     
 
     def update_board(self):   # 更新棋盘状态    
-        def print_board(board):
-            print("-------------")
-            for i in range(0, 9, 3):
-                print("|", end=' ')
-                for j in range(3):
-                    print(board[i+j] if board[i+j] != 0 else '.', end=' | ')
-                print("\n-------------")
-
-        time.sleep(2)  # 等待棋盘稳定
-        self.center_points      = cam.get_center_points()
-        self.board_chess_colors = cam.get_board_chess_colors()
-        logger.info(f"更新棋盘状态")
+        result, stable, elapsed = stabilizer.wait_stable()  # 等待棋盘稳定, 棋盘信息来自同一帧
+        if result is None:
+            logger.error("没有等到摄像头的新结果")
+            return False
+        if not stable:
+            logger.warning(f"棋盘在 {elapsed:.2f} s 内没有稳定, 使用最新一帧")
+        else:
+            logger.info(f"棋盘稳定耗时 {elapsed:.2f} s")
+
+        self.center_points      = result.center_points
+        self.board_chess_colors = list(result.board_chess_colors)  # 结果里是不可变的元组, AI 和旧代码按列表使用
+        logger.info(f"更新棋盘状态 (第 {result.frame_id} 帧, 处理耗时 {result.latency*1000:.0f} ms)")
 
         if self.center_points:
             # logger.info(f"棋盘格中心点: {self.center_points}")
@@ -68,10 +75,16 @@ class ChessBot:
             return False
 
     def update_chess_pos(self):  # 更新背景棋子位置
-        time.sleep(2)  # 等待棋盘稳定
-        self.black_coords = cam.get_black_coords()
-        self.white_coords = cam.get_white_coords()
-        logger.info("更新背景棋子位置")
+        result, stable, elapsed = stabilizer.wait_stable()  # 等待棋子稳定
+        if result is None:
+            logger.error("没有等到摄像头的新结果")
+            return False
+        if not stable:
+            logger.warning(f"棋子在 {elapsed:.2f} s 内没有稳定, 使用最新一帧")
+
+        self.black_coords = result.black_coords
+        self.white_coords = result.white_coords
+        logger.info(f"更新背景棋子位置 (第 {result.frame_id} 帧)")
         logger.info(f"黑色棋子数量: {len(self.black_coords)}") #, 位置: {self.black_coords}")
         logger.info(f"白色棋子数量: {len(self.white_coords)}") #, 位置: {self.white_coords}")
         
@@ -79,17 +92,20 @@ class ChessBot:
             logger.error("没有找到棋子的位置信息。")
             return False
 
+    def to_printer_coords(self, img_coords):  # 批量将图像坐标转换为打印机坐标, 返回 (N, 2) 整数数组
+        img_coords = np.asarray(img_coords, dtype=np.float64).reshape(-1, 2)
+        scaled = (img_coords / 10 * 2).astype(int)  # 与 int() 一样向零取整
+        printer_coords = np.empty_like(scaled)
+        printer_coords[:, 0] = scaled[:, 0] + 0 + self.PX_OFFSET
+        printer_coords[:, 1] = 251 - scaled[:, 1] - 60 + self.PY_OFFSET  # 翻转y轴
+        return printer_coords
+
     def to_printer_coord(self, img_coord):
-        printer_coord = [0, 0]
         # logger.info(f"转换坐标: {img_coord}")
-        printer_coord[0] = int(img_coord[0] / 10 * 2) + 0 + self.PX_OFFSET
-        printer_coord[1] = 251 - int(img_coord[1] / 10 * 2) - 60 + self.PY_OFFSET # 翻转y轴
-        return printer_coord
+        return [int(c) for c in self.to_printer_coords([img_coord])[0]]
     
     def pick_and_place(self, chess_color, grid_number):  # 抓取棋子并放置
 
-        bot = BambuRobot(reset=False)    # 重新初始化机器人, 以防掉线
-
         color_str = {self.BLACK: "黑色", self.WHITE: "白色" }
 
         logger.warning(f"正在拾取 {color_str[chess_color]} 棋，放置到 {grid_number} 号方格。")
@@ -106,7 +122,7 @@ class ChessBot:
                 return False
             from_x, from_y = self.to_printer_coord(self.white_coords[0])
 
-        if len(self.center_points) < 9:
+        if not 1 <= grid_number <= len(self.center_points):
             logger.error(f"棋盘上没有 {grid_number} 号方格的位置信息。")
             return False
 
@@ -114,23 +130,20 @@ class ChessBot:
 
         logger.info(f"正在将 {color_str[chess_color]} 棋从 {from_x} , {from_y} 移动到 {to_x} , {to_y}")
         
-        bot.capture_piece(from_x, from_y)  # 放置棋子
-        bot.release_piece(to_x, to_y)
-
-        bot.show_chess_board()
+        bot.move_piece(from_x, from_y, to_x, to_y)  # 拾取并放置棋子, 然后回到待机处展示棋盘
 
         return True
 
     def mode_1(self):
         
-        logger.info("进入模式 1: 装置将任意 1 颗黑棋子放置到 5 号方格中。\n")
+        logger.info(f"进入模式 1: 装置将任意 1 颗黑棋子放置到 {CENTER_GRID} 号方格中。\n")
 
         bot.show_chess_board()  # 展示棋盘
 
         self.update_chess_pos()  # 更新背景棋子位置
         self.update_board()
 
-        self.pick_and_place(chess_color=self.BLACK, grid_number=5) # 放置棋子 5 号方格
+        self.pick_and_place(chess_color=self.BLACK, grid_number=CENTER_GRID) # 放置棋子到中心方格
         
         time.sleep(1)
 
@@ -138,7 +151,6 @@ class ChessBot:
        
 
     def mode_2(self):
-        bot = BambuRobot(reset=False)    # 重新初始化机器人, 以防掉线
    
         logger.info("进入模式 2: 将任意 2 颗黑棋子和 2 颗白棋子依次放置到指定方格中。")
 
@@ -147,8 +159,6 @@ class ChessBot:
         placed_chess = 0  # 记录已经放置的棋子数量
 
         while placed_chess < 4:
-            bot = BambuRobot(reset=False)    # 重新初始化机器人, 以防掉线
-
             logger.info(f"\n正在放置第 {placed_chess + 1} 颗棋子:")
             chess_color = int(input(f"请输入要放置的棋子颜色 (1白色, -1黑色): "))
              
@@ -179,12 +189,10 @@ class ChessBot:
     
 
     def mode_3(self):
-        bot = BambuRobot(reset=False)    # 重新初始化机器人, 以防掉线
-
         while True:
             self.update_chess_pos()        
             logger.info("进入模式 3: 人机对弈。")
-            logger.info("\n若人先放置黑棋, 输入数字0回车, 人先手; \n输入1~9数字后回车, 机器执黑棋先手")
+            logger.info(f"\n若人先放置黑棋, 输入数字0回车, 人先手; \n输入1~{GRID_CELLS}数字后回车, 机器执黑棋先手")
 
             grid_number = input("请输入数字: ")
 
@@ -193,7 +201,7 @@ class ChessBot:
                 human_color = -1
                 bot_color   = 1
 
-                if len(self.board_chess_colors) != 9:
+                if len(self.board_chess_colors) != GRID_CELLS:
                     logger.error("棋盘上没有棋子信息。")
                     continue
                 else:
@@ -201,13 +209,13 @@ class ChessBot:
                     self.last_board_chess_colors = self.board_chess_colors # 初始化上一次的棋盘
                     break
 
-            elif grid_number in ['1', '2', '3', '4', '5', '6', '7', '8', '9']:
+            elif grid_number.isdigit() and 1 <= int(grid_number) <= GRID_CELLS:
                 logger.info("机器先手, 人执白棋 (1)")
                 bot_color   = -1
                 human_color = 1
                 self.pick_and_place(bot_color, int(grid_number))
                 
-                if len(self.board_chess_colors) != 9:
+                if len(self.board_chess_colors) != GRID_CELLS:
                     logger.error("棋盘上没有棋子信息。")
                     continue
                 else:
@@ -219,7 +227,7 @@ class ChessBot:
                 continue
 
        
-        ttt_ai = TicTacToeAI(bot_color, human_color, 0)
+        ttt_ai = TicTacToeAI(bot_color, human_color, 0, n=GRID_SIZE, k=WIN_LENGTH)
         logger.info("游戏正式开始")
 
         while True:
@@ -234,9 +242,11 @@ class ChessBot:
                     bot.notice_finish()
                 break
 
+            cam.scheduler.watching()        # 人下棋时全速运行, 随时可以看到棋盘
             done = input("人执完棋后, 请输入数字 0 继续: ")
-            
-            bot = BambuRobot(reset=False)    # 重新初始化机器人, 以防掉线
+
+            if not bot.ensure_connected():  # 长连接掉线时自动重连
+                logger.error(f"打印机连接异常: {bot.connection_health()}")
 
             if done == '0':
                 # 更新棋盘
@@ -252,10 +262,7 @@ class ChessBot:
                     from_x, from_y = self.to_printer_coord(self.center_points[fix_changes[0]])
                     to_x, to_y     = self.to_printer_coord(self.center_points[fix_changes[1]])
                     
-                    bot.capture_piece(from_x, from_y)  # 放置棋子
-                    bot.release_piece(to_x, to_y)
-
-                    bot.show_chess_board()
+                    bot.move_piece(from_x, from_y, to_x, to_y)  # 移回原位并展示棋盘
                     logger.info("修复完成, 继续游戏")
                     continue
                 
@@ -281,11 +288,13 @@ class ChessBot:
             bot.show_chess_board()  # 展示棋盘  
             print("\n--------------------------------------")
             print("选择模式：")
-            print("1: 模式 1 - 放置 1 颗黑棋到 5 号方格")
+            print(f"1: 模式 1 - 放置 1 颗黑棋到 {CENTER_GRID} 号方格")
             print("2: 模式 2 - 放置 2 颗黑棋和 2 颗白棋")
             print("3: 模式 3 - 人机对弈")
             print("q: 退出")
+            cam.scheduler.idle()            # 等待菜单输入时降低视觉帧率
             choice = input("输入你的选择: ")
+            cam.scheduler.watching()
             print("--------------------------------------")
 
             if choice == '1':
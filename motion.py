@@ -1,14 +1,196 @@
+import os
 import time
-import math
-import subprocess
+import json
+import threading
 
+import paho.mqtt.client as mqtt
 from bambu_connect import BambuClient  # pip install bambu-connect --index https://pypi.org/simple/
 from config import hostname, access_code, serial
+from motion_model import MotionTimeModel
+from pump import get_pump
+from scheduler import get_scheduler
+
+
+def default_client_factory():
+    return BambuClient(hostname, access_code, serial)
+
+
+class MotionMonitor:
+    """ 根据打印机上报的状态判断运动完成
+
+    打印机收下一条 gcode_line 请求时就会在 report 主题上回复同名命令, 这时命令 (包括末尾的 M400) 只是进了队列,
+    所以回复只说明打印机收到了命令. 运动完成以 gcode_state 为准: 执行队列时上报 RUNNING,
+    所有请求都得到回复, 且在 RUNNING 之后又上报空闲状态时, 说明末尾的 M400 已经执行完, 运动结束.
+    """
+
+    IDLE_STATES = ('IDLE', 'FINISH')
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.online = False      # 是否已经连上状态上报
+        self.sent = 0            # 已发送的 gcode_line 请求数
+        self.acked = 0           # 已收到的回复数
+        self.reports = 0         # 收到的状态消息总数
+        self.last_report_time = None
+        self.gcode_state = None  # 最近一次上报的 gcode_state
+        self.running_seen = False  # 上次完成之后是否上报过 RUNNING
+        self.finished = True       # 已发送的运动是否全部执行完
+
+    def on_connect(self):
+        with self.cond:
+            self.online = True
+
+    def on_report(self, status):
+        """ bambu_connect 的 message_callback, status 为 PrinterStatus 或含相同字段的对象 """
+        with self.cond:
+            self.reports += 1
+            self.last_report_time = time.monotonic()
+            if getattr(status, 'command', None) == 'gcode_line':
+                self.acked = min(self.acked + 1, self.sent)
+
+            state = getattr(status, 'gcode_state', None)  # 增量上报中可能没有这个字段
+            if state is not None:
+                self.gcode_state = state
+                if state == 'RUNNING':
+                    self.running_seen = True
+                elif state in self.IDLE_STATES and self.running_seen and self.acked >= self.sent:
+                    self.running_seen = False
+                    self.finished = True
+
+            self.cond.notify_all()
+
+    def on_send(self):
+        """ 在真正发送之前调用, 否则发送后马上到达的回复会因为 acked 不能超过 sent 而丢失 """
+        with self.cond:
+            self.sent += 1
+            self.finished = False
+
+    def cancel_send(self):
+        """ 发送失败时撤销 on_send """
+        with self.cond:
+            self.sent = max(0, self.sent - 1)
+            self.acked = min(self.acked, self.sent)
+
+    def wait_done(self, timeout):
+        """ 等待已发送的运动全部执行完, 超时返回 False 并重新对齐状态 """
+        with self.cond:
+            if self.cond.wait_for(lambda: self.finished, timeout):
+                return True
+            self.acked = self.sent       # 回复丢失时不要影响后续等待
+            self.running_seen = False    # 旧的 RUNNING 不能让下一次等待提前结束
+            self.finished = True
+            return False
+
+
+class GcodeBatch:
+    """ G-code 批处理: 收集一串移动和停顿命令, 拼成一条多行 G-code 一次发送 """
+
+    def __init__(self, motion):
+        self.motion = motion
+        self.lines = ["G90"]        # 批处理内统一使用绝对坐标
+        self.moves = []             # 每段运动 (dx, dy, dz, feed), 用于预测执行时间
+        self.dwell_time = 0.0       # 停顿时间之和 s
+        self.single_messages = 0    # 逐条调用 move() 等需要发送的消息数
+
+    def move(self, px, py, pz, speed=None):
+        motion = self.motion
+        if not motion._check_limits(px, py, pz):
+            return False
+
+        dx, dy, dz = px - motion.position_x, py - motion.position_y, pz - motion.position_z
+        motion.position_x, motion.position_y, motion.position_z = px, py, pz
+
+        speed = motion.MOTOR_SPEED if speed is None else speed
+
+        self.lines.append(f"G0 X{px} Y{py} Z{pz} F{speed}")
+        self.moves.append((dx, dy, dz, speed))
+        self.single_messages += 3  # move() 会逐条发送 G90, G0, M400
+        return True
+
+    def move_z(self, pz, speed=None):
+        return self.move(self.motion.position_x, self.motion.position_y, pz, speed)
+
+    def dwell(self, seconds):
+        self.lines.append(f"G4 P{int(seconds * 1000)}")  # 停顿, 单位 ms
+        self.dwell_time += seconds
+        self.single_messages += 1
+
+    def send(self, wait=True):
+        """ 发送整批命令, wait 为 True 时等待执行完毕, 返回节省的消息数
+
+        重连后仍然发送失败时抛出 ConnectionError, 不再等待, 调用方不能当作运动已经完成.
+        """
+
+        if self.single_messages == 0:
+            return 0
+
+        self.lines.append("M400")  # 等待所有命令执行完毕
+        start = time.monotonic()
+        ok = self.motion.send_gcode("\n".join(self.lines))
+        moves, dwell_time, saved = self.moves, self.dwell_time, self.single_messages - 1
+
+        self.lines = ["G90"]
+        self.moves = []
+        self.dwell_time = 0.0
+        self.single_messages = 0
+
+        if not ok:
+            raise ConnectionError("批量 G-code 发送失败")
+
+        self.motion.gcode_stats['batches'] += 1
+        self.motion.gcode_stats['messages_saved'] += saved
+
+        if wait:
+            self.motion.wait_motion(moves, start, dwell_time)  # 整批只等待一次
+
+        return saved
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.send()
 
 
 class BambuMotion:
-    def __init__(self, reset=True):
-        self.bambu_client = BambuClient(hostname, access_code, serial)
+    def __init__(self, reset=True, client_factory=None, completion=True, pump=None, scheduler=None):
+        # 连接参数
+        self.RECONNECT_RETRIES = 5      # 每次重连最多尝试次数
+        self.RECONNECT_DELAY = 0.5      # 第一次重试前的等待 s, 之后指数退避
+        self.RECONNECT_MAX_DELAY = 8.0  # 退避上限 s
+        self.IDLE_RECONNECT = 60        # bambu_connect 只在发送时运行网络循环, 空闲超过 keepalive 后主动重连
+
+        # 运动完成等待: 优先使用打印机上报的 gcode_state, 没有上报时按模型估算时间
+        self.COMPLETION_TIMEOUT_FACTOR = 2.0  # 等待上报的超时 = 估算时间 * 系数 + 附加时间
+        self.COMPLETION_TIMEOUT_PAD = 2.0
+        self.COMPLETION_MAX_TIMEOUTS = 2      # 连续超时这么多次后认为打印机不回复, 改用估算
+        self.completion = completion
+        self.completion_timeouts = 0
+        self.monitor = MotionMonitor()
+        self.motion_stats = {'report': 0, 'timeout': 0, 'estimate': 0}  # 各种方式结束等待的次数
+        self.scheduler = scheduler if scheduler is not None else get_scheduler()  # 运动期间通知视觉暂停抓帧
+
+        self.client_factory = client_factory or default_client_factory
+        self.bambu_client = None
+        self.last_send_time = 0.0
+        self.health = {
+            'connected': False,
+            'connects': 0,           # 成功建立连接的次数 (含重连)
+            'reconnects': 0,         # 连接出错后的重连次数
+            'idle_refreshes': 0,     # 空闲超时后例行重连的次数, 不算出错
+            'failures': 0,           # 发送或连接失败次数
+            'last_error': None,
+            'last_connect_time': None,
+            'last_connect_s': 0.0,   # 上次建立连接的耗时
+            'messages_sent': 0,
+        }
+        self.gcode_stats = {
+            'batches': 0,         # 批量发送次数
+            'messages_saved': 0,  # 相比逐条发送节省的消息数
+        }
+        self.connect()
+
         self.position_x = 250  # 默认位置
         self.position_y = 260
         self.position_z = 15
@@ -19,16 +201,207 @@ class BambuMotion:
         self.PY_LIMIT = [0, 260]
         self.PZ_LIMIT = [0, 200]
 
-        self.EXTRA_DELAY = 0.75
+        # 运动时间模型, 没有反馈时用于估算等待时间; 可用 motion_model.py 从运动日志标定
+        self.model = MotionTimeModel.load_or_default(os.environ.get('MOTION_MODEL', 'motion_model.json'))
+        self.move_log_path = os.environ.get('MOVE_LOG')  # 设置后记录每组运动的实际完成时间
 
         if reset:
             self.hard_reset()
         
-        subprocess.run(['gpio', 'mode', '3', 'out'])  # 打开气泵控制GPIO
+        self.pump = pump if pump is not None else get_pump()  # 气泵驱动, 进程内共用, GPIO 保持打开
+
+    def connect(self):
+        """ 建立与打印机的长连接 """
+        start = time.perf_counter()
+        self.bambu_client = self.client_factory()
+        self._mark_connected(time.perf_counter() - start)
+        self._start_watch()
+
+    def _start_watch(self):
+        """ 订阅打印机状态上报, 用于判断运动完成 """
+        if not self.completion:
+            return
+        self.monitor = MotionMonitor()
+        try:
+            self.bambu_client.start_watch_client(self.monitor.on_report, self.monitor.on_connect)
+        except Exception as e:
+            print(f"无法订阅打印机状态, 改用估算时间等待运动完成: {e!r}")
+
+    def wait_motion(self, moves, start, dwell=0.0):
+        """ 等待已发送的运动执行完毕, moves 为 [(dx, dy, dz, feed), ...], start 为开始发送的时间, 返回结束等待的方式 """
+
+        with self.scheduler.moving():  # 机械臂运动期间画面没有意义, 暂停视觉流水线
+            how = self._wait_completion(moves, start, dwell)
+
+        self.motion_stats[how] += 1
+        return how
+
+    def _wait_completion(self, moves, start, dwell):
+        predicted = self.model.predict(moves) + dwell
+
+        if self.completion and self.monitor.online:
+            timeout = predicted * self.COMPLETION_TIMEOUT_FACTOR + self.COMPLETION_TIMEOUT_PAD
+            if self.monitor.wait_done(timeout):  # 打印机上报执行完毕, 不必等满估算时间
+                self.completion_timeouts = 0
+                self.log_move(moves, time.monotonic() - start - dwell, predicted - dwell)  # 上报的完成时间是实测值
+                how = 'report'
+            else:
+                print(f"等待打印机上报运动完成超时 ({timeout:.2f} s)")
+                self.completion_timeouts += 1
+                if self.completion_timeouts >= self.COMPLETION_MAX_TIMEOUTS:
+                    print("打印机没有上报运动完成, 之后改用估算时间等待")
+                    self.completion = False
+                how = 'timeout'
+        else:
+            time.sleep(max(0.0, start + predicted - time.monotonic()))  # 按模型预测时间等待
+            how = 'estimate'
+
+        return how
+
+    def log_move(self, moves, observed, predicted):
+        """ 记录一组运动从发送到打印机上报执行完毕的实际时间 (不含停顿), 供 motion_model.py 标定
+
+        只在等到完成上报时调用, 超时或按估算等待的运动没有实测时间, 不记录.
+        """
+        if not self.move_log_path:
+            return
+        record = {'time': time.time(), 'moves': moves, 'observed': observed, 'predicted': predicted}
+        with open(self.move_log_path, 'a') as f:
+            f.write(json.dumps(record) + "\n")
+
+    def _mqtt_client(self):
+        """ bambu_connect 内部用于发送命令的 paho 客户端, 取不到时返回 None """
+        execute_client = getattr(self.bambu_client, 'executeClient', None)
+        return getattr(execute_client, 'client', None)
+
+    def _publish_gcode(self, gcode_command):
+        """ 发送一条 gcode_line 请求, 发布失败时抛出 ConnectionError
+
+        bambu_connect 的 send_gcode 会丢掉 paho publish 的返回值, 断线时也不报错,
+        所以这里用它内部的 paho 客户端按相同格式发布, 并检查返回码和连接状态.
+        """
+        mqtt_client = self._mqtt_client()
+        if mqtt_client is None:  # 不是 bambu_connect 的客户端 (例如 FakeBambuClient)
+            self.bambu_client.send_gcode(gcode_command)
+            return
+
+        serial = self.bambu_client.executeClient.serial
+        payload = f'{{"print": {{"command": "gcode_line", "sequence_id": 2006, "param": "{gcode_command} \n"}}, "user_id":"1234567890"}}'
+
+        mqtt_client.loop_start()
+        try:
+            info = mqtt_client.publish(f"device/{serial}/request", payload)
+        finally:
+            mqtt_client.loop_stop()
+
+        if info.rc != mqtt.MQTT_ERR_SUCCESS:
+            raise ConnectionError(f"MQTT 发布失败: {mqtt.error_string(info.rc)}")
+        if not mqtt_client.is_connected():
+            raise ConnectionError("MQTT 连接已断开")
+
+    def _mark_connected(self, elapsed, reconnect=False, refresh=False):
+        self.health['connected'] = True
+        self.health['connects'] += 1
+        self.health['reconnects'] += int(reconnect)
+        self.health['idle_refreshes'] += int(refresh)
+        self.health['last_connect_time'] = time.time()
+        self.health['last_connect_s'] = elapsed
+        self.last_send_time = time.monotonic()
+
+    def _mark_disconnected(self, error):
+        self.health['connected'] = False
+        self.health['failures'] += 1
+        self.health['last_error'] = repr(error)
+        print(f"与打印机的连接出错: {error!r}")
+
+    def is_connected(self):
+        # bambu_connect 的发送客户端平时不运行网络循环, 空闲时 paho 的 is_connected 反映不了真实状态,
+        # 这里以最近一次连接/发送的结果为准 (发送时检查发布返回码), 长时间空闲由 ensure_connected 主动重连
+        return self.bambu_client is not None and self.health['connected']
+
+    def _close_client(self):
+        """ 停止旧客户端的状态订阅和网络线程, 断开连接, 出错时忽略 (连接可能早已断开) """
+        client = self.bambu_client
+        if client is None:
+            return
+        try:
+            client.stop_watch_client()
+        except Exception as e:
+            print(f"停止打印机状态订阅出错: {e!r}")
+        mqtt_client = self._mqtt_client()
+        if mqtt_client is not None:
+            try:
+                mqtt_client.loop_stop()
+                mqtt_client.disconnect()
+            except Exception as e:
+                print(f"断开旧的 MQTT 连接出错: {e!r}")
+        self.bambu_client = None
+
+    def reconnect(self, idle=False):
+        """ 指数退避重连, 第一次尝试复用原有客户端, 之后关闭旧客户端并重新创建
+
+        idle 为 True 表示连接正常, 只是空闲太久的例行重连, 第一次就成功时单独计数.
+        """
+
+        delay = self.RECONNECT_DELAY
+
+        for attempt in range(1, self.RECONNECT_RETRIES + 1):
+            start = time.perf_counter()
+            try:
+                mqtt_client = self._mqtt_client()
+                if attempt == 1 and mqtt_client is not None:
+                    mqtt_client.reconnect()  # 复用已有的认证和 TLS 设置
+                else:
+                    self._close_client()  # 否则每次重连都会留下一个 paho 网络线程和连接
+                    self.bambu_client = self.client_factory()
+                    self._start_watch()
+                refresh = idle and attempt == 1
+                self._mark_connected(time.perf_counter() - start, reconnect=not refresh, refresh=refresh)
+                if not refresh:
+                    print(f"已重新连接打印机 (第 {attempt} 次尝试, 耗时 {self.health['last_connect_s']:.2f} s)")
+                return True
+
+            except Exception as e:
+                self._mark_disconnected(e)
+                if attempt < self.RECONNECT_RETRIES:
+                    time.sleep(delay)
+                    delay = min(delay * 2, self.RECONNECT_MAX_DELAY)
+
+        print("重连打印机失败")
+        return False
+
+    def ensure_connected(self):
+        idle = time.monotonic() - self.last_send_time
+        connected = self.is_connected()
+        if connected and idle < self.IDLE_RECONNECT:
+            return True
+        return self.reconnect(idle=connected)
+
+    def connection_health(self):
+        """ 连接状态, 供调用方查询和记录 """
+        health = dict(self.health)
+        health['connected'] = self.is_connected()
+        health['idle_s'] = time.monotonic() - self.last_send_time
+        return health
 
     def send_gcode(self, gcode_command):
-        self.bambu_client.send_gcode(gcode_command)
-        # print(f"发送了 G-code 命令: {gcode_command}")
+        for attempt in range(2):  # 发送失败时重连后再试一次
+            if not self.ensure_connected():
+                break
+            monitor = self.monitor  # 重连时会换成新的监视器
+            monitor.on_send()
+            try:
+                self._publish_gcode(gcode_command)
+                self.last_send_time = time.monotonic()
+                self.health['messages_sent'] += 1
+                # print(f"发送了 G-code 命令: {gcode_command}")
+                return True
+            except Exception as e:
+                monitor.cancel_send()
+                self._mark_disconnected(e)
+
+        print(f"G-code 命令发送失败: {gcode_command}")
+        return False
 
     def hard_reset(self):
         print("正在执行硬复位...")
@@ -72,49 +445,51 @@ class BambuMotion:
             return False
         
         dx, dy, dz = px - self.position_x, py - self.position_y, pz - self.position_z
-        distance = math.sqrt(dx**2 + dy**2 + dz**2)
-
         self.position_x, self.position_y, self.position_z = px, py, pz
 
         speed = self.MOTOR_SPEED if speed is None else speed  # 设置速度
 
-        self.send_gcode("G90 ; 设置为绝对坐标")
-        self.send_gcode(f"G0 X{px} Y{py} Z{pz} F{speed}")
-        self.send_gcode("M400 ; 等待 所有命令执行完毕")
+        start = time.monotonic()
+        sent = (self.send_gcode("G90 ; 设置为绝对坐标")
+                and self.send_gcode(f"G0 X{px} Y{py} Z{pz} F{speed}")
+                and self.send_gcode("M400 ; 等待 所有命令执行完毕"))
+        if not sent:  # 发送失败时不等待, 让调用方知道没有移动到位
+            return False
 
         if delay == 0:
-            delay = (distance / (speed/60)) + self.EXTRA_DELAY  # 计算需要等待的时间 + 额外延时
-            # print(f"等待 {delay} s")
-            time.sleep(delay)
+            self.wait_motion([(dx, dy, dz, speed)], start)  # 等待打印机回复, 没有回复时按模型预测时间等待
         else:
             time.sleep(delay)  # 手动暂停等待
 
         # print(f"已移动到 ({self.position_x}, {self.position_y}, {self.position_z})")
         return True
 
+    def batch(self):
+        """ 创建 G-code 批处理, 用 with 语句时退出时自动发送并等待 """
+        return GcodeBatch(self)
+
     def move_relative(self, dx, dy, dz, speed=None, delay=0):
         px, py, pz = self.position_x + dx, self.position_y + dy, self.position_z + dz
 
         if not self._check_limits(px, py, pz):
             return False
         
-        distance = math.sqrt(dx**2 + dy**2 + dz**2)  # 计算位移
-
         self.position_x, self.position_y, self.position_z = px, py, pz
 
         speed = self.MOTOR_SPEED if speed is None else speed  # 设置速度
 
-        self.send_gcode("G91 ; 设置为相对坐标")
-        self.send_gcode(f"G0 X{dx} Y{dy} Z{dz} F{speed}")
-        self.send_gcode("M400 ; 等待所有命令执行完毕")
-        self.send_gcode("G90 ; 设置回绝对坐标")
+        start = time.monotonic()
+        sent = (self.send_gcode("G91 ; 设置为相对坐标")
+                and self.send_gcode(f"G0 X{dx} Y{dy} Z{dz} F{speed}")
+                and self.send_gcode("M400 ; 等待所有命令执行完毕"))
+        self.send_gcode("G90 ; 设置回绝对坐标")  # 失败时也尽量恢复绝对坐标
+        if not sent:
+            return False
 
         # print(f"已移动到 ({self.position_x}, {self.position_y}, {self.position_z})")
 
         if delay == 0:
-            delay = (distance / (speed/60)) + self.EXTRA_DELAY  # 计算需要等待的时间 + 额外延时
-            # print(f"等待 {delay} s")
-            time.sleep(delay)
+            self.wait_motion([(dx, dy, dz, speed)], start)  # 等待打印机回复, 没有回复时按模型预测时间等待
         else:
             time.sleep(delay)
 
@@ -139,20 +514,18 @@ class BambuMotion:
         return self.move_relative(0, 0, dz, speed)
 
     def notice_finish(self):
-        self.bambu_client.send_gcode("""
+        self.send_gcode("""
             M1006 S1
             M1006 C37 D25 M69 
             M1006 W
                    """)
         time.sleep(2)
 
-    def pump_on(self):   # 启动拾取气泵
-        subprocess.run(['gpio', 'write', '3', '0'])
-        time.sleep(1)
+    def pump_on(self):   # 启动拾取气泵, 并等待气压稳定
+        self.pump.on()
 
-    def pump_off(self):  # 关闭拾取气泵
-        subprocess.run(['gpio', 'write', '3', '1'])
-        time.sleep(1)
+    def pump_off(self):  # 关闭拾取气泵, 并等待气压稳定
+        self.pump.off()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,157 @@
+import os
+import json
+import math
+import argparse
+
+
+class MotionTimeModel:
+    """ 梯形速度曲线的运动时间模型
+
+    每段运动按 起步速度(jerk) -> 匀加速 -> 匀速 -> 匀减速 估算时间, 速度和加速度按各轴上限折算.
+    一组命令 (一次发送并等待) 的预测时间 = 各段时间之和 + 固定开销 overhead + 余量 margin.
+
+    未标定的默认值不限制各轴速度和加速度, 此时每段时间就是 距离 / F 值, 加上 0.75 s 开销, 与原来的估算完全相同;
+    实际的轴限制 (例如 Z 轴远达不到 F48000) 由 fit() 从运动日志标定, 避免在没有数据时把等待时间估得比原来更长.
+    """
+
+    def __init__(self, max_speed=(math.inf, math.inf, math.inf), max_accel=(math.inf, math.inf, math.inf),
+                 jerk=9.0, overhead=0.75, margin=0.0):
+        self.max_speed = list(max_speed)  # 各轴最大速度 mm/s
+        self.max_accel = list(max_accel)  # 各轴最大加速度 mm/s^2
+        self.jerk = jerk                  # 起步/停止时允许的瞬时速度 mm/s
+        self.overhead = overhead          # 每组命令的固定开销 s (通信 + 固件处理)
+        self.margin = margin              # 标定得到的余量 s, 保证大部分运动在预测时间内完成
+
+    def move_time(self, dx, dy, dz, feed):
+        """ 单段运动时间 s, feed 为 G-code 中的 F 值 mm/min """
+
+        distance = math.sqrt(dx**2 + dy**2 + dz**2)
+        if distance == 0:
+            return 0.0
+
+        speed = feed / 60
+        accel = float('inf')
+        for delta, axis_speed, axis_accel in zip((dx, dy, dz), self.max_speed, self.max_accel):
+            if delta:  # 按各轴上限折算到运动方向
+                ratio = distance / abs(delta)
+                speed = min(speed, axis_speed * ratio)
+                accel = min(accel, axis_accel * ratio)
+
+        start_speed = min(self.jerk, speed)
+        accel_distance = (speed**2 - start_speed**2) / (2 * accel)
+
+        if 2 * accel_distance <= distance:  # 能加速到目标速度: 梯形
+            return 2 * (speed - start_speed) / accel + (distance - 2 * accel_distance) / speed
+
+        peak_speed = math.sqrt(accel * distance + start_speed**2)  # 加速不到目标速度: 三角形
+        return 2 * (peak_speed - start_speed) / accel
+
+    def motion_time(self, moves):
+        """ 多段运动的纯运动时间, moves 为 [(dx, dy, dz, feed), ...] """
+        return sum(self.move_time(*move) for move in moves)
+
+    def predict(self, moves):
+        """ 一组命令从发送到执行完毕的预测时间 s """
+        return self.motion_time(moves) + self.overhead + self.margin
+
+    def to_dict(self):
+        return {
+            'max_speed': self.max_speed,
+            'max_accel': self.max_accel,
+            'jerk': self.jerk,
+            'overhead': self.overhead,
+            'margin': self.margin,
+        }
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=4)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls(**json.load(f))
+
+    @classmethod
+    def load_or_default(cls, path):
+        if path and os.path.exists(path):
+            print(f"载入运动时间模型: {path}")
+            return cls.load(path)
+        return cls()
+
+
+def read_move_log(path):
+    """ 读取运动日志, 每行一条 {"moves": [[dx, dy, dz, feed], ...], "observed": s}
+
+    observed 是 BambuMotion 等到打印机上报执行完毕时测得的时间; 旧版本日志中只有 acked (收下命令的时间) 的记录会被跳过.
+    """
+
+    records = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                record = json.loads(line)
+                if 'observed' in record:
+                    records.append(record)
+    return records
+
+
+def percentile(values, q):
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, math.ceil(q / 100 * len(values)) - 1))
+    return values[index]
+
+
+def fit(records, quantile=95, base=None):
+    """ 用运动日志标定模型: 网格搜索 XY 加速度和 Z 轴速度, 固定开销取残差中位数, 余量取残差的分位数 """
+
+    base = base or MotionTimeModel()
+    best = None
+
+    for accel_xy in (2000, 4000, 6000, 8000, 10000, 15000, 20000):
+        for speed_z in (10, 15, 20, 30, 40, 60, math.inf):
+            model = MotionTimeModel(
+                max_speed=[base.max_speed[0], base.max_speed[1], speed_z],
+                max_accel=[accel_xy, accel_xy, base.max_accel[2]],
+                jerk=base.jerk,
+            )
+            residuals = [record['observed'] - model.motion_time(record['moves']) for record in records]
+            model.overhead = max(0.0, percentile(residuals, 50))
+            error = sum((residual - model.overhead)**2 for residual in residuals)
+
+            if best is None or error < best[0]:
+                best = (error, model, residuals)
+
+    error, model, residuals = best
+    model.margin = max(0.0, percentile(residuals, quantile) - model.overhead)
+
+    return model
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="用运动日志标定运动时间模型")
+    parser.add_argument('log', help="BambuMotion 记录的运动日志 (jsonl)")
+    parser.add_argument('-o', '--output', default='motion_model.json', help="输出的模型文件")
+    parser.add_argument('-q', '--quantile', type=float, default=95, help="余量覆盖的分位数")
+    args = parser.parse_args()
+
+    records = read_move_log(args.log)
+    if not records:
+        raise SystemExit(f"运动日志中没有带 observed 的记录: {args.log}")
+
+    old_model = MotionTimeModel()
+    model = fit(records, args.quantile)
+
+    def report(name, m):
+        errors = [m.predict(r['moves']) - r['observed'] for r in records]
+        late = sum(e < 0 for e in errors)
+        print(f"{name}: 平均多等 {sum(errors)/len(errors):.3f} s, 预测不足 {late}/{len(records)} 次")
+
+    print(f"共 {len(records)} 条记录")
+    report("默认模型", old_model)
+    report("标定模型", model)
+    print(json.dumps(model.to_dict(), indent=4))
+
+    model.save(args.output)
+    print(f"模型已保存到 {args.output}")
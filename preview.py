@@ -0,0 +1,239 @@
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import numpy as np
+
+
+INDEX_HTML = """<!doctype html>
+<html><head><meta charset="utf-8"><title>chess vision</title></head>
+<body style="margin:0;background:#222;color:#ddd;font-family:monospace">
+<img src="/stream.mjpg" style="max-width:100%;display:block">
+<pre id="state"></pre>
+<script>
+setInterval(() => fetch('/state.json').then(r => r.json()).then(s => {
+  document.getElementById('state').textContent = JSON.stringify(s.result, null, 1);
+}), 1000);
+</script>
+</body></html>
+"""
+
+
+class PreviewServer:
+    """ 无界面设备上的调试预览, 只用标准库的 HTTP 服务
+
+    /             简单的网页, 显示图像流和最新结果
+    /stream.mjpg  标注后的棋盘图像 (MJPEG), 限制在 fps 帧每秒
+    /snapshot.jpg 下一帧的标注图像
+    /state.json   最新的棋盘状态, 棋子坐标和各阶段耗时
+    /metrics      Prometheus 文本格式的统计
+
+    有客户端在看图像流时才向相机注册为观看者, 相机才会绘制调试图像.
+    JPEG 编码在单独的线程中进行, 不占用识别和绘制线程; 客户端越多, 压缩质量越低.
+    """
+
+    def __init__(self, camera, port=8080, host='0.0.0.0', fps=5.0, quality=80, min_quality=40, max_width=960):
+        self.camera = camera
+        self.host = host
+        self.port = port
+        self.fps = fps
+        self.quality = quality            # 只有一个客户端时的 JPEG 质量
+        self.min_quality = min_quality    # 客户端很多时的最低质量
+        self.max_width = max_width        # 超过这个宽度时先缩小再编码
+
+        self.cond = threading.Condition()
+        self.clients = 0
+        self.running = False
+        self._buffer = None       # 绘制线程交过来的图像, 拷贝到这里后交给编码线程
+        self._pending = False     # _buffer 里有还没编码的图像
+        self._last_accept = 0.0
+        self.jpeg = None          # 最新编码好的 JPEG
+        self.jpeg_id = 0
+
+        self.stats = {'encoded': 0, 'skipped': 0, 'encode_ms': 0.0, 'bytes': 0}
+
+        self.httpd = None
+        self.server_thread = None
+        self.encoder_thread = None
+
+    # 观看者接口, 在相机的显示线程中调用, 只做一次拷贝
+
+    def show(self, name, img):
+        if name != 'img_chess':
+            return
+
+        now = time.perf_counter()
+        with self.cond:
+            if now - self._last_accept < 1 / self.fps or self._pending:  # 限速, 编码还没跟上时也丢弃
+                self.stats['skipped'] += 1
+                return
+            self._last_accept = now
+
+            if self._buffer is None or self._buffer.shape != img.shape:
+                self._buffer = img.copy()
+            else:
+                np.copyto(self._buffer, img)  # 相机的绘图缓冲区会被下一帧复用
+            self._pending = True
+            self.cond.notify_all()
+
+    def current_quality(self):
+        """ 每多一个客户端质量降 10, 不低于 min_quality """
+        return max(self.min_quality, self.quality - 10 * max(0, self.clients - 1))
+
+    def encode_loop(self):
+        """ 编码线程: 把最新一帧编码为 JPEG, 唤醒所有等待的客户端 """
+
+        while True:
+            with self.cond:
+                while self.running and not self._pending:
+                    self.cond.wait(0.5)
+                if not self.running:
+                    break
+                img = self._buffer
+                quality = self.current_quality()
+
+            start = time.perf_counter()
+            if img.shape[1] > self.max_width:
+                scale = self.max_width / img.shape[1]
+                img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            ok, data = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, quality])
+            elapsed = (time.perf_counter() - start) * 1000
+
+            with self.cond:
+                self._pending = False  # 编码完成后 show 才能覆盖 _buffer
+                if ok:
+                    self.jpeg = data.tobytes()
+                    self.jpeg_id += 1
+                    self.stats['encoded'] += 1
+                    self.stats['encode_ms'] += elapsed
+                    self.stats['bytes'] += len(self.jpeg)
+                self.cond.notify_all()
+
+    def wait_jpeg(self, last_id, timeout=1.0):
+        """ 等待比 last_id 新的 JPEG, 返回 (id, 数据), 超时返回 (last_id, None) """
+        deadline = time.perf_counter() + timeout
+        with self.cond:
+            while self.running and self.jpeg_id <= last_id:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    return last_id, None
+                self.cond.wait(remaining)
+            if self.jpeg_id <= last_id:
+                return last_id, None
+            return self.jpeg_id, self.jpeg
+
+    def client_joined(self):
+        with self.cond:
+            self.clients += 1
+            first = self.clients == 1
+        if first:  # 第一个客户端来时才让相机开始绘制
+            self.camera.add_viewer(self)
+
+    def client_left(self):
+        with self.cond:
+            self.clients -= 1
+            last = self.clients == 0
+        if last:
+            self.camera.remove_viewer(self)
+
+    def get_stats(self):
+        with self.cond:
+            stats = dict(self.stats, clients=self.clients, quality=self.current_quality())
+        stats['mean_encode_ms'] = stats['encode_ms'] / stats['encoded'] if stats['encoded'] else 0.0
+        return stats
+
+    def start(self):
+        """ 在后台线程中启动 HTTP 服务和编码线程 """
+        if self.running:
+            return
+
+        handler = type('PreviewHandler', (PreviewHandler,), {'preview': self})
+        self.httpd = ThreadingHTTPServer((self.host, self.port), handler)
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]  # port=0 时取实际分配的端口
+
+        self.running = True
+        self.encoder_thread = threading.Thread(target=self.encode_loop, daemon=True)
+        self.server_thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.encoder_thread.start()
+        self.server_thread.start()
+        print(f"调试预览已启动: http://{self.host}:{self.port}/")
+
+    def stop(self):
+        if not self.running:
+            return
+
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.camera.remove_viewer(self)
+        self.encoder_thread.join()
+
+
+class PreviewHandler(BaseHTTPRequestHandler):
+    """ 请求处理, preview 属性由 PreviewServer.start 设置 """
+
+    preview = None
+    BOUNDARY = 'frame'
+
+    def log_message(self, format, *args):
+        pass  # 不在终端刷访问日志
+
+    def do_GET(self):
+        path = self.path.split('?', 1)[0]
+
+        if path in ('/', '/index.html'):
+            self._send(200, 'text/html; charset=utf-8', INDEX_HTML.encode())
+        elif path == '/stream.mjpg':
+            self._stream()
+        elif path == '/snapshot.jpg':
+            img = self.preview.camera.snapshot()
+            if img is None:
+                self._send(503, 'text/plain; charset=utf-8', "没有可用的图像\n".encode())
+                return
+            ok, data = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, self.preview.quality])
+            self._send(200, 'image/jpeg', data.tobytes())
+        elif path == '/state.json':
+            state = self.preview.camera.get_state()
+            state['preview'] = self.preview.get_stats()
+            body = json.dumps(state, ensure_ascii=False, default=str).encode()
+            self._send(200, 'application/json; charset=utf-8', body)
+        elif path == '/metrics':
+            self._send(200, 'text/plain; version=0.0.4', self.preview.camera.metrics().encode())
+        else:
+            self._send(404, 'text/plain; charset=utf-8', b"not found\n")
+
+    def _send(self, code, content_type, body):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream(self):
+        preview = self.preview
+        self.send_response(200)
+        self.send_header('Content-Type', f'multipart/x-mixed-replace; boundary={self.BOUNDARY}')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+
+        preview.client_joined()
+        try:
+            last_id = 0
+            while preview.running:
+                last_id, jpeg = preview.wait_jpeg(last_id)
+                if jpeg is None:
+                    continue
+                self.wfile.write(f'--{self.BOUNDARY}\r\nContent-Type: image/jpeg\r\nContent-Length: {len(jpeg)}\r\n\r\n'.encode())
+                self.wfile.write(jpeg)
+                self.wfile.write(b'\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # 客户端断开
+        finally:
+            preview.client_left()
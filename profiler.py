@@ -0,0 +1,149 @@
+import os
+import json
+import time
+import threading
+import collections
+from contextlib import contextmanager
+
+import numpy as np
+
+
+class StageTimer:
+    """ 流水线分阶段计时: 每个阶段保留最近 window 次耗时用于计算分位数, 同时累计总次数和总耗时
+
+    with timer.stage('board'):
+        ...
+    timer.frame_done()  # 一帧处理完, 用于统计滚动帧率
+    """
+
+    QUANTILES = (50, 95, 99)
+
+    def __init__(self, window=300, fps_window=5.0):
+        self.window = window          # 每个阶段保留的样本数
+        self.fps_window = fps_window  # 滚动帧率的时间窗口 s
+
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.samples = collections.OrderedDict()  # 阶段名 -> 最近的耗时 ms
+            self.totals = {}                          # 阶段名 -> [次数, 总耗时 ms]
+            self.frame_times = collections.deque()    # 最近完成的帧的时间点
+            self.frames = 0
+            self.dropped = 0
+            self.started = time.time()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name, seconds):
+        """ 记录一次阶段耗时 s """
+        ms = seconds * 1000
+        with self.lock:
+            samples = self.samples.get(name)
+            if samples is None:
+                samples = self.samples[name] = collections.deque(maxlen=self.window)
+                self.totals[name] = [0, 0.0]
+            samples.append(ms)
+            self.totals[name][0] += 1
+            self.totals[name][1] += ms
+
+    def frame_done(self):
+        now = time.perf_counter()
+        with self.lock:
+            self.frames += 1
+            self.frame_times.append(now)
+            while self.frame_times and now - self.frame_times[0] > self.fps_window:
+                self.frame_times.popleft()
+
+    def count_dropped(self, n=1):
+        """ 记录没有被处理的帧 """
+        if n > 0:
+            with self.lock:
+                self.dropped += n
+
+    def fps(self):
+        with self.lock:
+            times = list(self.frame_times)
+        if len(times) < 2:
+            return 0.0
+        span = times[-1] - times[0]
+        return (len(times) - 1) / span if span > 0 else 0.0
+
+    def stage_stats(self, name):
+        """ 单个阶段的 p50/p95/p99/平均/最大 (ms, 最近 window 次) 和累计次数 """
+        with self.lock:
+            samples = np.array(self.samples.get(name, ()), dtype=np.float64)
+            count, total = self.totals.get(name, (0, 0.0))
+
+        stats = {'count': count, 'total_ms': total}
+        if len(samples):
+            for q, value in zip(self.QUANTILES, np.percentile(samples, self.QUANTILES)):
+                stats[f'p{q}'] = float(value)
+            stats['mean'] = float(samples.mean())
+            stats['max'] = float(samples.max())
+        else:
+            stats.update({f'p{q}': 0.0 for q in self.QUANTILES}, mean=0.0, max=0.0)
+        return stats
+
+    def snapshot(self):
+        with self.lock:
+            names = list(self.samples)
+            frames, dropped = self.frames, self.dropped
+
+        return {
+            'uptime': time.time() - self.started,
+            'frames': frames,
+            'dropped': dropped,
+            'fps': self.fps(),
+            'stages': {name: self.stage_stats(name) for name in names},
+        }
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.snapshot(), **kwargs)
+
+    def to_prometheus(self, prefix='chess_vision'):
+        """ Prometheus 文本格式, 阶段耗时为 summary (分位数取最近 window 次) """
+
+        snapshot = self.snapshot()
+        lines = [
+            f"# HELP {prefix}_frames_total Frames processed.",
+            f"# TYPE {prefix}_frames_total counter",
+            f"{prefix}_frames_total {snapshot['frames']}",
+            f"# HELP {prefix}_dropped_frames_total Frames captured but never processed.",
+            f"# TYPE {prefix}_dropped_frames_total counter",
+            f"{prefix}_dropped_frames_total {snapshot['dropped']}",
+            f"# HELP {prefix}_fps Rolling processed frames per second.",
+            f"# TYPE {prefix}_fps gauge",
+            f"{prefix}_fps {snapshot['fps']:.3f}",
+            f"# HELP {prefix}_stage_ms Per-stage processing time in milliseconds.",
+            f"# TYPE {prefix}_stage_ms summary",
+        ]
+        for name, stats in snapshot['stages'].items():
+            for q in self.QUANTILES:
+                lines.append(f'{prefix}_stage_ms{{stage="{name}",quantile="{q / 100}"}} {stats[f"p{q}"]:.3f}')
+            lines.append(f'{prefix}_stage_ms_sum{{stage="{name}"}} {stats["total_ms"]:.3f}')
+            lines.append(f'{prefix}_stage_ms_count{{stage="{name}"}} {stats["count"]}')
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, path):
+        """ 写入文件, .prom 结尾时用 Prometheus 格式, 否则用 JSON; 先写临时文件再改名, 读取方不会读到半个文件 """
+        text = self.to_prometheus() if path.endswith('.prom') else self.to_json(indent=2)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+    def summary(self):
+        """ 一行一个阶段的文字汇总 """
+        snapshot = self.snapshot()
+        lines = [f"帧数 {snapshot['frames']}, 丢帧 {snapshot['dropped']}, FPS {snapshot['fps']:.1f}"]
+        for name, s in snapshot['stages'].items():
+            lines.append(f"  {name:<12} p50 {s['p50']:7.2f} ms  p95 {s['p95']:7.2f} ms  p99 {s['p99']:7.2f} ms  ({s['count']} 次)")
+        return '\n'.join(lines)
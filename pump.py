@@ -0,0 +1,174 @@
+import os
+import time
+import subprocess
+
+
+class PumpDriver:
+    """ 气泵驱动基类, GPIO 输出低电平时气泵打开 """
+
+    ON_LEVEL = 0
+    OFF_LEVEL = 1
+
+    def __init__(self, settle=1.0):
+        self.settle = settle      # 开关后等待气压稳定的时间 s
+        self.is_on = None
+        self.writes = 0
+        self.last_write_s = 0.0   # 上次写 GPIO 的耗时
+
+    def _write(self, level):
+        raise NotImplementedError
+
+    def set(self, on, wait=True):
+        start = time.perf_counter()
+        self._write(self.ON_LEVEL if on else self.OFF_LEVEL)
+        self.last_write_s = time.perf_counter() - start
+        self.writes += 1
+        self.is_on = on
+
+        if wait and self.settle > 0:
+            time.sleep(self.settle)
+
+    def on(self, wait=True):
+        self.set(True, wait)
+
+    def off(self, wait=True):
+        self.set(False, wait)
+
+    def close(self):
+        pass
+
+
+class CliPump(PumpDriver):
+    """ 调用 gpio 命令行 (WiringPi 编号), 每次开关都会启动一个进程, 只作为后备 """
+
+    def __init__(self, pin=3, settle=1.0):
+        super().__init__(settle)
+        self.pin = str(pin)
+        subprocess.run(['gpio', 'mode', self.pin, 'out'])  # 打开气泵控制GPIO
+        self.off(wait=False)
+
+    def _write(self, level):
+        subprocess.run(['gpio', 'write', self.pin, str(level)])
+
+
+class SysfsPump(PumpDriver):
+    """ 通过 /sys/class/gpio 控制, value 文件一直保持打开, 开关只是一次文件写入 """
+
+    def __init__(self, gpio, settle=1.0, root='/sys/class/gpio'):
+        super().__init__(settle)
+        self.path = os.path.join(root, f'gpio{gpio}')
+
+        if not os.path.exists(self.path):  # 导出 GPIO
+            with open(os.path.join(root, 'export'), 'w') as f:
+                f.write(str(gpio))
+            time.sleep(0.1)  # 等待 udev 设置权限
+
+        with open(os.path.join(self.path, 'direction'), 'w') as f:
+            f.write('high' if self.OFF_LEVEL == 1 else 'low')  # 设为输出, 同时设置初始电平为关闭
+
+        self.value_file = open(os.path.join(self.path, 'value'), 'w')
+        self.is_on = False
+
+    def _write(self, level):
+        self.value_file.seek(0)
+        self.value_file.write(str(level))
+        self.value_file.flush()
+
+    def close(self):
+        self.value_file.close()
+
+
+class GpiodPump(PumpDriver):
+    """ 通过 libgpiod 字符设备控制, 线路在整个进程中保持占用 """
+
+    def __init__(self, line, chip='/dev/gpiochip0', settle=1.0):
+        super().__init__(settle)
+        import gpiod  # 可选依赖: pip install gpiod
+
+        self.gpiod = gpiod
+        self.line = int(line)
+
+        if hasattr(gpiod, 'request_lines'):  # libgpiod 2.x
+            from gpiod.line import Direction, Value
+            self.values = {0: Value.INACTIVE, 1: Value.ACTIVE}
+            self.request = gpiod.request_lines(chip, consumer='chess_pump', config={
+                self.line: gpiod.LineSettings(direction=Direction.OUTPUT, output_value=self.values[self.OFF_LEVEL]),
+            })
+        else:                                # libgpiod 1.x
+            self.values = None
+            self.request = gpiod.Chip(chip).get_line(self.line)
+            self.request.request(consumer='chess_pump', type=gpiod.LINE_REQ_DIR_OUT, default_vals=[self.OFF_LEVEL])
+
+        self.is_on = False
+
+    def _write(self, level):
+        if self.values is not None:
+            self.request.set_value(self.line, self.values[level])
+        else:
+            self.request.set_value(level)
+
+    def close(self):
+        self.request.release()
+
+
+class FakePump(PumpDriver):
+    """ 内存中的模拟气泵, 记录每次开关, 用于测试 """
+
+    def __init__(self, settle=0.0):
+        super().__init__(settle)
+        self.history = []  # [(time.monotonic(), 电平), ...]
+        self.off(wait=False)
+
+    def _write(self, level):
+        self.history.append((time.monotonic(), level))
+
+
+def create_pump(kind=None, settle=None):
+    """ 按名字创建气泵驱动: gpiod / sysfs / cli / fake, 默认读取环境变量, 自动选择时优先字符设备
+
+    PUMP_DRIVER     驱动类型, 默认 auto
+    PUMP_GPIO_LINE  gpiod 的线路号, 也是 sysfs 的 GPIO 编号; 不设置时自动选择 gpio 命令行并打印警告
+                    (WiringPi 引脚号与线路号的对应关系随开发板不同, 无法自动换算)
+    PUMP_GPIO_CHIP  gpiod 字符设备, 默认 /dev/gpiochip0
+    PUMP_WPI_PIN    gpio 命令行使用的 WiringPi 引脚, 默认 3
+    PUMP_SETTLE     开关后的等待时间 s, 默认 1.0
+    """
+
+    kind = kind or os.environ.get('PUMP_DRIVER', 'auto')
+    settle = float(os.environ.get('PUMP_SETTLE', 1.0)) if settle is None else settle
+    line = os.environ.get('PUMP_GPIO_LINE')
+    chip = os.environ.get('PUMP_GPIO_CHIP', '/dev/gpiochip0')
+    pin = os.environ.get('PUMP_WPI_PIN', 3)
+
+    if kind == 'auto':
+        if line is None:
+            print(f"警告: 没有设置 PUMP_GPIO_LINE, 气泵改用 gpio 命令行 (WiringPi 引脚 {pin}), "
+                  f"每次开关都要启动进程, 较慢; 设置 PUMP_GPIO_LINE 可使用 gpiod/sysfs")
+            kind = 'cli'
+        else:
+            try:
+                return GpiodPump(line, chip, settle)
+            except (ImportError, OSError) as e:
+                print(f"无法使用 gpiod 控制气泵, 改用 sysfs: {e!r}")
+                kind = 'sysfs'
+
+    if kind == 'gpiod':
+        return GpiodPump(line, chip, settle)
+    elif kind == 'sysfs':
+        return SysfsPump(line, settle)
+    elif kind == 'cli':
+        return CliPump(pin, settle)
+    elif kind == 'fake':
+        return FakePump(settle)
+
+    raise ValueError(f"未知的气泵驱动类型: {kind}")
+
+
+_pump = None  # 整个进程共用一个气泵驱动, GPIO 只初始化一次
+
+
+def get_pump():
+    global _pump
+    if _pump is None:
+        _pump = create_pump()
+    return _pump
@@ -2,8 +2,8 @@ import time
 from motion import BambuMotion
 
 class BambuRobot(BambuMotion):
-    def __init__(self, reset=True):
-        super().__init__(reset=reset)
+    def __init__(self, reset=True, client_factory=None, completion=True, pump=None, scheduler=None):
+        super().__init__(reset=reset, client_factory=client_factory, completion=completion, pump=pump, scheduler=scheduler)
         self.STANDBY_Z = 15   # 待机高度
         self.CHESS_Z = 2     # 棋子高度
         self.Z_SPEED = 48000  # Z轴速度
@@ -23,29 +23,28 @@ class BambuRobot(BambuMotion):
 
     def capture_piece(self, from_x, from_y):
         print("开始 捕获棋子")
-        self.pump_on()                             # 气泵打开
-        self.move(from_x, from_y, self.STANDBY_Z)  # 移动到棋子 起始位置
-        self.move_z(self.CHESS_Z)                  # 下降 
+        with self.scheduler.moving():                              # 包括气泵开关在内暂停视觉
+            self.pump_on()                                         # 气泵打开
 
-        print("用气泵 拾取棋子")
-        # self.notice_finish()  
-        # time.sleep(2)                              # 等待吸起棋子
-
-        self.move_z(self.STANDBY_Z)                # 抬起 
+            with self.batch() as batch:                            # 整个拾取动作一次发送
+                batch.move(from_x, from_y, self.STANDBY_Z)         # 移动到棋子 起始位置
+                batch.move_z(self.CHESS_Z, self.Z_SPEED)           # 下降 
+                # batch.dwell(2)                                   # 等待吸起棋子
+                batch.move_z(self.STANDBY_Z, self.Z_SPEED)         # 抬起 
 
         print(f"捕获棋子于 ({from_x}, {from_y}) \n")
 
     def release_piece(self, to_x, to_y):  
         print("开始 释放棋子")
-        self.move(to_x, to_y, self.STANDBY_Z)    # 移动到棋子 目标位置
-        # self.move_z(self.CHESS_Z)              # 下降 
-        self.move_z(self.CHESS_Z + 4)            # 下降 
-        self.pump_off()                          # 气泵打开 
-        # self.notice_finish()                    # 用气泵 释放棋子
+        with self.scheduler.moving():                              # 包括气泵开关和停顿在内暂停视觉
+            with self.batch() as batch:
+                batch.move(to_x, to_y, self.STANDBY_Z)             # 移动到棋子 目标位置
+                batch.move_z(self.CHESS_Z + 4, self.Z_SPEED)       # 下降 
 
-        print("用气泵 释放棋子")
-        time.sleep(0.2)                         # 等待放下棋子
-        self.move_z(self.STANDBY_Z)             # 抬起
+            self.pump_off()                                        # 气泵关闭, 释放棋子
+            print("用气泵 释放棋子")
+            time.sleep(0.2)                                        # 等待放下棋子
+            self.move_z(self.STANDBY_Z)                            # 抬起
 
         print(f"释放棋子到 ({to_x}, {to_y}) \n")
 
@@ -56,11 +55,29 @@ class BambuRobot(BambuMotion):
         print("待机并展示棋盘 \n")
 
     def move_piece(self, from_x, from_y, to_x, to_y):
-        self.capture_piece(from_x, from_y)
-        self.release_piece(to_x, to_y)
-        self.show_chess_board()
+        """ 拾取并放置棋子, 气泵开关之间的动作各自合并成一条 G-code 发送 """
+
+        saved_before = self.gcode_stats['messages_saved']
+
+        with self.scheduler.moving():                              # 整个过程 (包括气泵开关) 暂停视觉
+            self.pump_on()                                         # 气泵打开
+
+            with self.batch() as batch:                            # 拾取并移动到目标上方
+                batch.move(from_x, from_y, self.STANDBY_Z)         # 移动到棋子 起始位置
+                batch.move_z(self.CHESS_Z, self.Z_SPEED)           # 下降
+                batch.move_z(self.STANDBY_Z, self.Z_SPEED)         # 抬起
+                batch.move(to_x, to_y, self.STANDBY_Z)             # 移动到棋子 目标位置
+                batch.move_z(self.CHESS_Z + 4, self.Z_SPEED)       # 下降
+
+            self.pump_off()                                        # 气泵关闭, 释放棋子
+            time.sleep(0.2)                                        # 等待放下棋子
+
+            with self.batch() as batch:                            # 抬起并回到待机处展示棋盘
+                batch.move_z(self.STANDBY_Z, self.Z_SPEED)
+                batch.move(250, 260, self.STANDBY_Z, 15000)
 
-        print(f"棋子从 ({from_x}, {from_y}) 移动到 ({to_x}, {to_y}) \n")
+        saved = self.gcode_stats['messages_saved'] - saved_before
+        print(f"棋子从 ({from_x}, {from_y}) 移动到 ({to_x}, {to_y}), 合并发送节省了 {saved} 条消息 \n")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,140 @@
+import time
+import threading
+from contextlib import contextmanager
+
+
+class VisionScheduler:
+    """ 按对局状态调节视觉流水线的帧率
+
+    idle        等待菜单输入等, 低帧率运行 (idle_interval 秒一帧)
+    watching    等待人下棋, 全速运行 (watching_interval 秒一帧, 默认不限制)
+    arm_moving  机械臂运动中, 画面没有意义, 暂停抓帧
+
+    wake() 在一段时间内强制全速运行 (优先于 idle/watching, 但机械臂运动时仍然暂停), 用于 update_board 等需要立即拿到新结果的场合,
+    拿到结果后用 sleep() 提前结束.
+    """
+
+    IDLE = 'idle'
+    WATCHING = 'watching'
+    ARM_MOVING = 'arm_moving'
+
+    def __init__(self, idle_interval=1.0, watching_interval=0.0, wake_duration=5.0, state=WATCHING):
+        self.intervals = {
+            self.IDLE: idle_interval,
+            self.WATCHING: watching_interval,
+            self.ARM_MOVING: None,  # None 表示暂停
+        }
+        self.wake_duration = wake_duration
+
+        self.cond = threading.Condition()
+        self.base_state = state
+        self.moving_depth = 0        # 嵌套的 moving() 层数
+        self.wake_until = 0.0        # 在此之前全速运行
+
+        self.state_since = time.perf_counter()
+        self.state_durations = {self.IDLE: 0.0, self.WATCHING: 0.0, self.ARM_MOVING: 0.0}
+
+    @property
+    def state(self):
+        return self.ARM_MOVING if self.moving_depth > 0 else self.base_state
+
+    def _account(self):
+        """ 状态改变前累计上一个状态的持续时间 """
+        now = time.perf_counter()
+        self.state_durations[self.state] += now - self.state_since
+        self.state_since = now
+
+    def set_state(self, state):
+        if state not in self.intervals:
+            raise ValueError(f"未知的视觉状态: {state}")
+
+        with self.cond:
+            if state == self.base_state:
+                return
+            self._account()
+            self.base_state = state
+            self.cond.notify_all()
+
+    def idle(self):
+        self.set_state(self.IDLE)
+
+    def watching(self):
+        self.set_state(self.WATCHING)
+
+    @contextmanager
+    def moving(self):
+        """ 机械臂运动期间暂停抓帧, 结束后恢复之前的状态, 可以嵌套 """
+        with self.cond:
+            self._account()
+            self.moving_depth += 1
+        try:
+            yield
+        finally:
+            with self.cond:
+                self._account()
+                self.moving_depth -= 1
+                self.cond.notify_all()
+
+    def wake(self, duration=None):
+        """ 接下来 duration 秒内全速运行, 立即唤醒正在等待的抓帧线程 """
+        duration = self.wake_duration if duration is None else duration
+        with self.cond:
+            self.wake_until = max(self.wake_until, time.perf_counter() + duration)
+            self.cond.notify_all()
+
+    def sleep(self):
+        """ 提前结束 wake() 的全速运行 """
+        with self.cond:
+            self.wake_until = 0.0
+
+    def interval(self):
+        """ 当前的抓帧间隔 s, None 表示暂停 """
+        if self.moving_depth > 0:  # 机械臂运动时即使在 wake 期间也暂停
+            return None
+        if time.perf_counter() < self.wake_until:
+            return 0.0
+        return self.intervals[self.state]
+
+    def wait_turn(self, last_grab, timeout=0.5):
+        """ 等到下一帧该抓的时候, 返回 (是否该抓帧, 是否等待过); 超时返回 (False, True), 调用方可借机检查是否需要退出 """
+
+        deadline = time.perf_counter() + timeout
+        waited = False
+
+        with self.cond:
+            while True:
+                now = time.perf_counter()
+                interval = self.interval()
+
+                if interval is not None:
+                    due = last_grab + interval
+                    if now >= due:
+                        return True, waited
+                    wait = min(due, deadline) - now
+                else:
+                    wait = deadline - now
+
+                if wait <= 0:
+                    return False, True
+
+                self.cond.wait(wait)
+                waited = True
+
+    def get_stats(self):
+        with self.cond:
+            self._account()
+            return {
+                'state': self.state,
+                'awake': time.perf_counter() < self.wake_until,
+                'durations': dict(self.state_durations),
+            }
+
+
+_scheduler = None  # 视觉和运动共用一个调度器
+
+
+def get_scheduler():
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = VisionScheduler()
+    return _scheduler
@@ -0,0 +1,265 @@
+import os
+import glob
+import time
+
+import cv2
+
+
+# 摄像头参数
+camera_params = {
+    'camera_id': "/dev/video-4k",
+    # 'camera_id': 0,
+    # 'image_width': 1920,
+    # 'image_height': 1080,
+    'image_width': 1280,
+    'image_height': 720,
+    'auto_exposure': 1,
+    'exposure_time': 5000,
+    'fps': 30,
+    'gain': 100,
+    'auto_wb': 0,
+    'wb_temperature': 5000,
+    'contrast': 42,
+}
+
+
+class FrameSource:
+    """ 帧来源基类, read() 返回 (是否成功, 图像, 时间戳 s)
+
+    live 为 True 的来源 (摄像头) 读取失败时会重试; 回放来源读完后 finished 为 True.
+    回放来源的时间戳是从第一帧开始的媒体时间, realtime=True 时按时间戳 (除以 speed) 的节奏输出, 否则尽快输出.
+    """
+
+    live = False
+
+    def __init__(self, realtime=False, speed=1.0):
+        self.realtime = realtime
+        self.speed = speed
+        self.finished = False
+        self.frames = 0        # 已输出的帧数
+        self._start = None     # (第一帧的墙上时间, 第一帧的时间戳)
+
+    def open(self):
+        return True
+
+    def is_opened(self):
+        return not self.finished
+
+    def _next(self):
+        """ 子类实现: 返回 (图像, 时间戳), 没有更多帧时返回 None """
+        raise NotImplementedError
+
+    def _pace(self, timestamp):
+        """ 实时回放时等到这一帧的时间点 """
+        now = time.perf_counter()
+        if self._start is None:
+            self._start = (now, timestamp)
+            return
+
+        due = self._start[0] + (timestamp - self._start[1]) / self.speed
+        if due > now:
+            time.sleep(due - now)
+
+    def read(self):
+        if self.finished:
+            return False, None, 0.0
+
+        item = self._next()
+        if item is None:
+            self.finished = True
+            return False, None, 0.0
+
+        frame, timestamp = item
+        if self.realtime:
+            self._pace(timestamp)
+
+        self.frames += 1
+        return True, frame, timestamp
+
+    def flush(self):
+        """ 丢弃来源内部缓冲的旧帧, 暂停抓帧一段时间后调用 """
+        pass
+
+    def release(self):
+        self.finished = True
+
+    def __iter__(self):
+        """ 逐帧迭代 (图像, 时间戳), 直到来源结束 """
+        while True:
+            ret, frame, timestamp = self.read()
+            if not ret:
+                if self.finished:
+                    return
+                continue
+            yield frame, timestamp
+
+
+class V4L2Source(FrameSource):
+    """ USB 摄像头, 打开时设置曝光/白平衡等参数 """
+
+    live = True
+
+    def __init__(self, params=None):
+        super().__init__()
+        params = camera_params if params is None else params
+
+        # 获取相机参数
+        self.fps = params.get('fps', 60)
+        self.camera_id = params.get('camera_id', 0)
+        self.image_width = params.get('image_width', 1280)
+        self.image_height = params.get('image_height', 720)
+        self.auto_exposure = params.get('auto_exposure', 1)
+        self.exposure_time = params.get('exposure_time', 100)
+        self.gain = params.get('gain', 0)
+        self.auto_wb = params.get('auto_wb', 0)
+        self.wb_temperature = params.get('wb_temperature', 5000)
+        self.contrast = params.get('contrast', 27)
+
+        # 初始化相机
+        print(f'开始初始化 {self.camera_id} 号相机相机...')
+        self.cap = cv2.VideoCapture(self.camera_id)
+        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)  # 设置缓冲区大小为 1, 只读取最新一帧
+
+        print(f'初始化了 {self.camera_id} 号相机, 开始设置参数...')
+        self.set_camera_parameters() # 设置相机参数
+
+    def set_camera_parameters(self):
+        self.cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc('M', 'J', 'P', 'G'))
+        self.cap.set(cv2.CAP_PROP_FPS, self.fps)
+        self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.image_width)
+        self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.image_height)
+        self.cap.set(cv2.CAP_PROP_AUTO_EXPOSURE, self.auto_exposure)
+        self.cap.set(cv2.CAP_PROP_EXPOSURE, self.exposure_time)
+        self.cap.set(cv2.CAP_PROP_GAIN, self.gain)
+        self.cap.set(cv2.CAP_PROP_AUTO_WB, self.auto_wb)  # 关闭自动白平衡
+        self.cap.set(cv2.CAP_PROP_WB_TEMPERATURE, self.wb_temperature)  # 设置白平衡色温
+        self.cap.set(cv2.CAP_PROP_CONTRAST, self.contrast)
+
+
+        print(f"设置的相机: {self.camera_id} 号相机")
+        print(f"设置的分辨率: {self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)} x {self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)}")
+        print(f"设置的帧率: {self.cap.get(cv2.CAP_PROP_FPS)}")
+
+    def open(self):
+        """ 摄像头没有打开时重新打开一次, 返回是否已打开 """
+        if self.cap.isOpened():
+            return True
+
+        self.cap = cv2.VideoCapture(self.camera_id)
+        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)  # 设置缓冲区大小为 1, 只读取最新一帧
+        if self.cap.isOpened():
+            self.set_camera_parameters()
+        return self.cap.isOpened()
+
+    def is_opened(self):
+        return self.cap.isOpened()
+
+    def read(self):
+        ret, frame = self.cap.read()
+        if ret:
+            self.frames += 1
+        return ret, frame, time.time()
+
+    def flush(self):
+        self.cap.grab()  # 缓冲区只有 1 帧, 丢掉它, 下一次读到的就是新拍的
+
+    def release(self):
+        if self.cap.isOpened():
+            self.cap.release()  # 释放摄像头资源
+
+
+class VideoFileSource(FrameSource):
+    """ 录制的视频文件, 时间戳取视频自身的播放时间 """
+
+    def __init__(self, path, realtime=False, speed=1.0, loop=False):
+        super().__init__(realtime, speed)
+        self.path = path
+        self.loop = loop
+        self.cap = cv2.VideoCapture(path)
+        self._offset = 0.0  # 循环播放时累加的时间
+
+        if not self.cap.isOpened():
+            print(f"无法打开视频文件: {path}")
+            self.finished = True
+
+    def _next(self):
+        ret, frame = self.cap.read()
+        if not ret and self.loop and self.frames > 0:
+            self._offset = self._last_timestamp + 1 / max(1.0, self.cap.get(cv2.CAP_PROP_FPS))
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ret, frame = self.cap.read()
+        if not ret:
+            return None
+
+        self._last_timestamp = self._offset + self.cap.get(cv2.CAP_PROP_POS_MSEC) / 1000
+        return frame, self._last_timestamp
+
+    def release(self):
+        super().release()
+        self.cap.release()
+
+
+class ImageDirSource(FrameSource):
+    """ 图片文件夹, 按文件名排序, 每张图间隔 1/fps 秒 """
+
+    EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+    def __init__(self, path, fps=10.0, realtime=False, speed=1.0, loop=False, pattern='*'):
+        super().__init__(realtime, speed)
+        self.fps = fps
+        self.loop = loop
+        self.paths = sorted(p for p in glob.glob(os.path.join(path, pattern))
+                            if p.lower().endswith(self.EXTENSIONS))
+        self.index = 0
+
+        if not self.paths:
+            print(f"文件夹中没有图片: {path}")
+            self.finished = True
+
+    def _next(self):
+        for _ in range(len(self.paths)):  # 最多把所有图片试一遍
+            if self.index >= len(self.paths) and not self.loop:
+                return None
+
+            path = self.paths[self.index % len(self.paths)]
+            timestamp = self.index / self.fps
+            self.index += 1
+
+            frame = cv2.imread(path)
+            if frame is not None:
+                return frame, timestamp
+            print(f"无法读取图片, 跳过: {path}")
+
+        return None
+
+
+class GeneratorSource(FrameSource):
+    """ 内存中的帧, 可迭代对象产生 图像 或 (图像, 时间戳); 没有时间戳时按 fps 生成 """
+
+    def __init__(self, frames, fps=30.0, realtime=False, speed=1.0):
+        super().__init__(realtime, speed)
+        self.iterator = iter(frames)
+        self.fps = fps
+        self.index = 0
+
+    def _next(self):
+        try:
+            item = next(self.iterator)
+        except StopIteration:
+            return None
+
+        timestamp = self.index / self.fps
+        self.index += 1
+
+        if isinstance(item, tuple):
+            return item
+        return item, timestamp
+
+
+def create_source(video=None, images=None, realtime=False, speed=1.0, loop=False, fps=10.0):
+    """ 按参数创建帧来源, 都不指定时使用摄像头 """
+    if video:
+        return VideoFileSource(video, realtime, speed, loop)
+    if images:
+        return ImageDirSource(images, fps, realtime, speed, loop)
+    return V4L2Source()
@@ -0,0 +1,73 @@
+import time
+
+
+class BoardStabilizer:
+    """ 棋盘稳定检测: 连续 k 帧识别结果一致 (且画面运动量足够小) 时认为棋盘已稳定 """
+
+    def __init__(self, camera, k=3, motion_threshold=None, timeout=5.0):
+        self.camera = camera
+        self.k = k                                  # 需要连续一致的帧数
+        self.motion_threshold = motion_threshold    # 帧差运动量上限 (0~1), None 表示不检查
+        self.timeout = timeout                      # 默认超时 s
+
+        self.last_elapsed = 0.0  # 上一次稳定所花的时间 s
+
+    @staticmethod
+    def result_key(result):
+        """ 用于比较两帧识别结果是否一致
+
+        用单帧的 raw_board_chess_colors: 过滤后的结果是多帧投票, 棋子刚放下时可能还是旧状态并连续一致,
+        会在画面真正稳定前就判为稳定.
+        """
+        return result.raw_board_chess_colors, len(result.black_coords), len(result.white_coords)
+
+    def wait_stable(self, timeout=None):
+        """ 等待棋盘稳定, 返回 (最后一帧结果, 是否稳定, 耗时 s), 一直没有新帧时结果为 None """
+
+        timeout = self.timeout if timeout is None else timeout
+        start = time.perf_counter()
+
+        wake = getattr(self.camera, 'wake', None)
+        if wake is not None:  # 视觉降频时立即恢复全速, 返回时结束
+            wake(timeout)
+        try:
+            return self._wait(start, timeout)
+        finally:
+            if wake is not None:
+                self.camera.sleep()
+
+    def _wait(self, start, timeout):
+        deadline = start + timeout
+
+        result = None
+        last_key = None
+        agree_count = 0
+        last_id = self.camera.get_result().frame_id  # 只统计请求之后拍到的帧
+
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+
+            new_result = self.camera.wait_for_result(newer_than=last_id, timeout=remaining)
+            if new_result is None:
+                break
+
+            result = new_result
+            last_id = result.frame_id
+
+            if self.motion_threshold is not None and result.motion > self.motion_threshold:
+                last_key = None  # 画面还在动, 重新计数
+                agree_count = 0
+                continue
+
+            key = self.result_key(result)
+            agree_count = agree_count + 1 if key == last_key else 1
+            last_key = key
+
+            if agree_count >= self.k:
+                self.last_elapsed = time.perf_counter() - start
+                return result, True, self.last_elapsed
+
+        self.last_elapsed = time.perf_counter() - start  # 超时由调用方根据返回值报告
+        return result, False, self.last_elapsed
@@ -1,7 +1,13 @@
+import time
+import atexit
+from contextlib import nullcontext
+
 from pupil_apriltags import Detector
 import numpy as np
 import cv2
 
+import debug_sink
+
 
 # 初始化一个Detector实例，用于检测和解码Apriltag标记
 at_detector = Detector(
@@ -13,12 +19,20 @@ at_detector = Detector(
     decode_sharpening=0.25,  # 设置解码过程中的图像锐化程度，以提高解码成功率
     debug=0,  # 设置调试模式级别，0表示不启用调试模式
 )
+# pupil_apriltags 的析构函数先释放标记族, 再销毁检测器时又会访问它, 进程退出时偶尔破坏堆而崩溃;
+# 检测器本来就与进程同生命周期, 退出时跳过析构, 由操作系统回收
+atexit.register(lambda: setattr(at_detector, 'tag_detector_ptr', None))
+
+REQUIRED_IDS = [24, 26, 21, 29]  # 底板四个角的标记 id: 左上, 右上, 右下, 左下
+# REQUIRED_IDS = [4, 9, 19, 14]
+
 
 def pre_process(img):
     # 预处理
     img_gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)  # 将图像转换为灰度图像
     img_blur = cv2.GaussianBlur(img_gray, (3, 3), 0)  # 应用高斯滤波以平滑图像
     _, img_bin = cv2.threshold(img_blur, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)  # 二值化
+    debug_sink.show('img_bin', img_bin)
 
     return img_bin
 
@@ -62,6 +76,30 @@ def detect_tags(img):
 
     return detections
 
+def detect_tags_in_tiles(img, tiles):
+    """ 只在 tiles = {tag_id: (x0, y0, x1, y1)} 给出的小块内检测对应 id 的标记, 坐标换算回整幅图像
+
+    每块单独预处理 (Otsu 阈值按块计算), 返回 (检测结果, 没有找到的 id 列表)
+    """
+
+    detections = []
+    missing = []
+
+    for tag_id, (x0, y0, x1, y1) in tiles.items():
+        found = [d for d in detect_tags(pre_process(img[y0:y1, x0:x1])) if d.tag_id == tag_id]
+        if not found:
+            missing.append(tag_id)
+            continue
+
+        detection = found[0]
+        offset = np.array([x0, y0], dtype=np.float64)
+        detection.corners = detection.corners + offset
+        detection.center = detection.center + offset
+        detection.homography = np.array([[1, 0, x0], [0, 1, y0], [0, 0, 1]], dtype=np.float64) @ detection.homography
+        detections.append(detection)
+
+    return detections, missing
+
 def sort_corners(corners):
     """ 根据角度对四个角点进行排序，确保顺序为左上角、右上角、右下角、左下角。  """
     
@@ -82,28 +120,20 @@ def tags_to_quad_vertices(detections):
 
     # 确保每个需要的 id 都存在
     tag_ids = [detection.tag_id for detection in detections]
-    # required_ids = [4, 9, 19, 14]  # 需要的 id
-    required_ids = [24, 26, 21, 29]  # 需要的 id
 
-    if len(tag_ids) < 4 or not all(tag_id in tag_ids for tag_id in required_ids):
+    if len(tag_ids) < 4 or not all(tag_id in tag_ids for tag_id in REQUIRED_IDS):
         # print(f"Apriltag 标记不全, 无法继续进行识别, 识别到: {tag_ids}")
         return None
 
-    # 提取标记的角点坐标
+    # 提取标记的角点坐标, REQUIRED_IDS 中第 i 个标记取它的第 i 个角点 (左上, 右上, 右下, 左下)
+    quad_vertices = [None] * 4
     for detection in detections:
 
         detection.corners = sort_corners(detection.corners) # 对角点坐标排序
 
-        if detection.tag_id == 24:                 
-            x1, y1 = detection.corners[0].tolist()  # 左上
-        elif detection.tag_id == 26:               
-            x2, y2 = detection.corners[1].tolist()  # 右上
-        elif detection.tag_id == 21:            
-            x3, y3 = detection.corners[2].tolist()  # 右下
-        elif detection.tag_id == 29:            
-            x4, y4 = detection.corners[3].tolist()  # 左下
-
-    quad_vertices = [[x1, y1], [x2, y2], [x3, y3], [x4, y4]]
+        if detection.tag_id in REQUIRED_IDS:
+            index = REQUIRED_IDS.index(detection.tag_id)
+            quad_vertices[index] = detection.corners[index].tolist()
 
     # print(f"Apriltag 标记坐标: {quad_vertices}")
 
@@ -127,32 +157,41 @@ def homo_trans(quad_vertices, width=int((2560-100)/2), height=int((2100-100)/2))
 
     return H_matrix, H_inv
 
+def transform_points(points, matrix):
+    # 批量坐标变换 (chess.py 也用这个), 输入 N 个坐标, 输出 (N, 2) 浮点坐标
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 1, 2)
+    return cv2.perspectiveTransform(points, np.asarray(matrix, dtype=np.float64)).reshape(-1, 2)
+
 def transform_image_to_object(point_raw, H_matrix):
     # 输入图像坐标系坐标，输出长方形区域坐标系坐标
-    point_homogeneous = np.array([point_raw[0], point_raw[1], 1])  # 转换为齐次坐标
-    transformed_point = H_matrix @ point_homogeneous  # 进行变换
-    return transformed_point[0] / transformed_point[2], transformed_point[1] / transformed_point[2]
+    x, y = transform_points([point_raw], H_matrix)[0]
+    return x, y
 
 def transform_object_to_image(point_obj, H_inv):
     # 输入长方形区域坐标系坐标，输出图像坐标系坐标
-    point_homogeneous = np.array([point_obj[0], point_obj[1], 1])  # 转换为齐次坐标
-    transformed_point = H_inv @ point_homogeneous  # 进行反向变换
-    return transformed_point[0] / transformed_point[2], transformed_point[1] / transformed_point[2]
+    x, y = transform_points([point_obj], H_inv)[0]
+    return x, y
 
 def transform_object_to_printer(point_obj):
-    # 长方形区域坐标系 转换为 打印机坐标系
-    point_printer = [0, 0]
-    point_printer[0] = (point_obj[0] / 10) + 16
-    point_printer[1] = 224 - (point_obj[1] / 10) + 16  # 翻转y轴
-
+    # 长方形区域坐标系 转换为 打印机坐标系, 单个坐标返回列表 [x, y], (N, 2) 数组返回 (N, 2) 数组
+    point_obj = np.asarray(point_obj, dtype=np.float64)
+    point_printer = np.empty_like(point_obj)
+    point_printer[..., 0] = (point_obj[..., 0] / 10) + 16
+    point_printer[..., 1] = 224 - (point_obj[..., 1] / 10) + 16  # 翻转y轴
+
+    if point_printer.ndim == 1:
+        return point_printer.tolist()
     return point_printer
 
-def draw_homo_trans(img, H_matrix, width=int((2560-100)/2), height=int((2100-100)/2)):
+def draw_homo_trans(img, H_matrix, width=int((2560-100)/2), height=int((2100-100)/2), inverse=True):
 # def draw_homo_trans(img, H_matrix, width=2560-100, height=2100-100):
 
     # 应用透视变换
     warped_image = cv2.warpPerspective(img, H_matrix , (width, height))
 
+    if not inverse:  # 不需要反向变换的图像时直接返回
+        return warped_image, None
+
     # 计算反向变换矩阵
     H_inv = np.linalg.inv(H_matrix)
 
@@ -162,13 +201,260 @@ def draw_homo_trans(img, H_matrix, width=int((2560-100)/2), height=int((2100-100
 
     return warped_image, reversed_warped_image
 
-def draw_tags(img, detections):
+class TagTracker:
+    """ 底板标记跟踪: 只在关键帧运行 Apriltag 检测, 其余帧用四个角点附近的小块相关性确认底板没动
+
+    需要检测时, 先只在四个标记上次位置附近 (外扩 tile_margin 像素) 的小块内检测,
+    有标记没找到时才退回整幅图像检测. 小块检测只返回这四个标记.
+    小块按自己的 Otsu 阈值二值化, 角点与整幅检测相差不到 0.5 像素 (img/tag_4.png 上约 0.38 像素).
+    """
+
+    def __init__(self, keyframe_interval=30, patch_size=24, min_score=0.8, timer=None, tile_search=True, tile_margin=48):
+        self.keyframe_interval = keyframe_interval  # 最多隔多少帧强制重新检测一次
+        self.patch_size = patch_size                # 角点周围小块的边长
+        self.min_score = min_score                  # 相关系数低于该值认为底板移动了
+        self.timer = timer                          # 可选的分阶段计时器 (profiler.StageTimer)
+        self.tile_search = tile_search              # 是否先在上次位置附近的小块内检测
+        self.tile_margin = tile_margin              # 小块在标记外接矩形基础上外扩的像素数
+
+        self.quad_vertices = None
+        self.detections = []
+        self.templates = None
+        self.tag_boxes = {}  # 每个底板标记上次的外接矩形 (x0, y0, x1, y1)
+        self.frames_since_keyframe = 0
+
+        self.stats = {
+            'frames': 0,          # 总帧数
+            'hits': 0,            # 跟踪成功, 复用上次结果
+            'misses': 0,          # 相关性检查失败, 重新检测
+            'keyframes': 0,       # 到达间隔强制重新检测
+            'detects': 0,         # 检测次数 (小块或整幅)
+            'tile_detects': 0,    # 只在小块内检测就找齐了标记
+            'tile_fallbacks': 0,  # 小块内没找齐, 退回整幅检测
+            'full_detects': 0,    # 整幅图像检测次数
+            'detect_ms_last': 0.0,
+            'detect_ms_mean': 0.0,
+            'detect_ms_max': 0.0,
+        }
+
+    def _extract_patches(self, img_gray, quad_vertices):
+        """ 截取每个角点周围的小块, 任何一块超出图像时返回 None """
+
+        half = self.patch_size // 2
+        height, width = img_gray.shape[:2]
+        patches = []
+
+        for x, y in quad_vertices:
+            x, y = int(round(x)), int(round(y))
+            if x - half < 0 or y - half < 0 or x + half > width or y + half > height:
+                return None
+            patches.append(img_gray[y-half:y+half, x-half:x+half])
+
+        return patches
+
+    def _check(self, img_gray):
+        """ 当前帧角点小块与模板的归一化相关性都足够高时, 认为底板没动 """
+
+        patches = self._extract_patches(img_gray, self.quad_vertices)
+        if patches is None:
+            return False
+
+        for patch, template in zip(patches, self.templates):
+            score = cv2.matchTemplate(patch, template, cv2.TM_CCOEFF_NORMED)[0][0]
+            if not np.isfinite(score) or score < self.min_score:
+                return False
+
+        return True
+
+    def _stage(self, name):
+        return self.timer.stage(name) if self.timer is not None else nullcontext()
+
+    def _tiles(self, shape):
+        """ 由上次的外接矩形得到本次检测的小块, 缺少任何一个标记时返回 None """
+
+        height, width = shape[:2]
+        margin = self.tile_margin
+        tiles = {}
+
+        for tag_id in REQUIRED_IDS:
+            box = self.tag_boxes.get(tag_id)
+            if box is None:
+                return None
+            x0, y0, x1, y1 = box
+            tiles[tag_id] = (max(0, int(x0 - margin)), max(0, int(y0 - margin)),
+                             min(width, int(x1 + margin) + 1), min(height, int(y1 + margin) + 1))
+
+        return tiles
+
+    def _update_boxes(self, detections):
+        self.tag_boxes = {}
+        for detection in detections:
+            if detection.tag_id in REQUIRED_IDS:
+                corners = np.asarray(detection.corners)
+                x0, y0 = corners.min(axis=0)
+                x1, y1 = corners.max(axis=0)
+                self.tag_boxes[detection.tag_id] = (x0, y0, x1, y1)
+
+    def _detect(self, img, img_gray):
+        """ 检测标记 (优先只检测小块), 并记录检测耗时 """
+
+        start = time.perf_counter()
+        stats = self.stats
+
+        detections = None
+        tiles = self._tiles(img.shape) if self.tile_search else None
+        if tiles is not None:
+            with self._stage('tag_tiles'):
+                detections, missing = detect_tags_in_tiles(img, tiles)  # 只检测上次位置附近
+            if missing:
+                stats['tile_fallbacks'] += 1
+                detections = None
+            else:
+                stats['tile_detects'] += 1
+
+        if detections is None:  # 没有历史位置或小块内没找齐
+            with self._stage('pre_process'):
+                img_pre = pre_process(img)                          # 预处理
+            with self._stage('detect_tags'):
+                detections = detect_tags(img_pre)                   # 检测标记
+            stats['full_detects'] += 1
+
+        quad_vertices = tags_to_quad_vertices(detections)       # 获取四个角点
+
+        detect_ms = (time.perf_counter() - start) * 1000
+
+        stats['detects'] += 1
+        stats['detect_ms_last'] = detect_ms
+        stats['detect_ms_mean'] += (detect_ms - stats['detect_ms_mean']) / stats['detects']
+        stats['detect_ms_max'] = max(stats['detect_ms_max'], detect_ms)
+
+        self.detections = detections
+        self.quad_vertices = quad_vertices
+        self.frames_since_keyframe = 0
+
+        if quad_vertices is not None:  # 保存角点模板和标记位置, 供后续帧比较和小块检测
+            patches = self._extract_patches(img_gray, quad_vertices)
+            self.templates = [patch.copy() for patch in patches] if patches is not None else None
+            self._update_boxes(detections)
+        else:
+            self.templates = None
+            self.tag_boxes = {}
+
+        return quad_vertices, detections
+
+    def update(self, img):
+        """ 输入 BGR 图像, 返回 (quad_vertices, detections), 与 tags_to_quad_vertices/detect_tags 的结果一致 """
+
+        self.stats['frames'] += 1
+        self.frames_since_keyframe += 1
+
+        img_gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+        if self.templates is None:  # 还没有可跟踪的结果
+            return self._detect(img, img_gray)
+
+        if self.frames_since_keyframe >= self.keyframe_interval:  # 定期强制重新检测
+            self.stats['keyframes'] += 1
+            return self._detect(img, img_gray)
+
+        with self._stage('tag_check'):
+            unchanged = self._check(img_gray)
+
+        if unchanged:
+            self.stats['hits'] += 1
+            return self.quad_vertices, self.detections
+
+        self.stats['misses'] += 1
+        return self._detect(img, img_gray)
+
+    def reset(self):
+        self.quad_vertices = None
+        self.detections = []
+        self.templates = None
+        self.tag_boxes = {}
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        checked = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / checked if checked else 0.0
+        stats['tile_rate'] = stats['tile_detects'] / stats['detects'] if stats['detects'] else 0.0
+        return stats
+
+
+class BoardWarper:
+    """ 底板透视变换, 缓存单应矩阵和 remap 查找表, 相机静止时每帧只做一次 remap """
+
+    def __init__(self, width=int((2560-100)/2), height=int((2100-100)/2), tolerance=1.0):
+        self.width = width
+        self.height = height
+        self.tolerance = tolerance  # 角点移动小于该像素数时复用缓存
+
+        self.quad_vertices = None
+        self.H_matrix = None
+        self._H_inv = None
+        self._maps = None
+
+    def update(self, quad_vertices):
+        """ 更新四个角点, 只有角点移动超过容差时才重新计算矩阵和查找表 """
+
+        quad = np.array(quad_vertices, dtype='float32')
+
+        if self.quad_vertices is not None and np.max(np.abs(quad - self.quad_vertices)) <= self.tolerance:
+            return self.H_matrix  # 角点没动, 复用缓存
+
+        H_matrix, _ = homo_trans(quad, self.width, self.height)
+
+        # 用 initUndistortRectifyMap 生成透视变换的查找表: 相机矩阵取单位阵, 无畸变, R 取 H
+        # 此时每个目标像素映射到 H^-1 * (u, v, 1), 与 warpPerspective 等价
+        maps = cv2.initUndistortRectifyMap(np.eye(3), None, H_matrix, np.eye(3),
+                                           (self.width, self.height), cv2.CV_16SC2)
+
+        self.quad_vertices = quad
+        self.H_matrix = H_matrix
+        self._H_inv = None  # 反向矩阵按需计算
+        self._maps = maps
+
+        return H_matrix
+
+    @property
+    def H_inv(self):
+        if self._H_inv is None and self.H_matrix is not None:
+            self._H_inv = np.linalg.inv(self.H_matrix)
+        return self._H_inv
+
+    def warp(self, img):
+        """ 正向变换到底板坐标系 """
+        if self._maps is None:
+            return None
+        return cv2.remap(img, self._maps[0], self._maps[1], cv2.INTER_LINEAR)
+
+    def inverse_warp(self, warped_image, shape):
+        """ 反向变换回原图像空间, 只在确实需要时调用 """
+        if self.H_matrix is None:
+            return None
+        height_original, width_original = shape[:2]
+        return cv2.warpPerspective(warped_image, self.H_inv, (width_original, height_original))
+
+    def reset(self):
+        self.quad_vertices = None
+        self.H_matrix = None
+        self._H_inv = None
+        self._maps = None
+
+
+def draw_tags(img, detections, inplace=False, H_matrix=None):
+    """ 绘制 tag 边框和 ID, inplace=True 时直接画在 img 上; 给出 H_matrix 时把 tag 投影到透视变换后的图像上 """
 
-    img_draw = img.copy()
+    img_draw = img if inplace else img.copy()
 
     # 绘制检测结果
     for detection in detections:
         corners = detection.corners
+        center = detection.center
+        if H_matrix is not None:
+            points = np.vstack([corners, center]).reshape(-1, 1, 2).astype('float32')
+            points = cv2.perspectiveTransform(points, H_matrix).reshape(-1, 2)
+            corners, center = points[:4], points[4]
 
         # 绘制边界框
         for i in range(4):
@@ -181,7 +467,7 @@ def draw_tags(img, detections):
             )  # 绿色线条
 
         # 在中心绘制标签 ID
-        center = int(detection.center[0]-15), int(detection.center[1]+12)
+        center = int(center[0]-15), int(center[1]+12)
         cv2.putText(
             img_draw,
             f"{detection.tag_id}",
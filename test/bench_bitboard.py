@@ -0,0 +1,82 @@
+import os
+import sys
+import random
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from ai import TicTacToeAI, BitBoard, has_win  # noqa: E402
+
+
+class ListRules:
+    """ 原来基于列表的规则实现, 作为对照 """
+
+    def __init__(self, player1=-1, player2=1, empty=0):
+        self.players = [player1, player2]
+        self.empty = empty
+        self.win_lines = [
+            [0, 1, 2], [3, 4, 5], [6, 7, 8],
+            [0, 3, 6], [1, 4, 7], [2, 5, 8],
+            [0, 4, 8], [2, 4, 6]
+        ]
+
+    def get_empty_positions(self, board):
+        return [i for i in range(9) if board[i] == self.empty]
+
+    def check_win(self, board, player):
+        for line in self.win_lines:
+            if all(board[i] == player for i in line):
+                return True
+        return False
+
+    def check_game_over(self, board):
+        for player in self.players:
+            if self.check_win(board, player):
+                return player
+        if not self.get_empty_positions(board):
+            return 99
+        return False
+
+
+def random_boards(n, seed=0):
+    rng = random.Random(seed)
+    return [[rng.choice([-1, 0, 1]) for _ in range(9)] for _ in range(n)]
+
+
+def bench(name, func, boards, number=20):
+    t = timeit.timeit(lambda: [func(b) for b in boards], number=number)
+    us = t / (number * len(boards)) * 1e6
+    print(f"{name:<40} {us:8.3f} us/次")
+    return us
+
+
+if __name__ == "__main__":
+    boards = random_boards(5000)
+    bitboards = [BitBoard.from_list(b) for b in boards]
+
+    lists = ListRules()
+    ai = TicTacToeAI(level='casual')
+
+    for b, bb in zip(boards, bitboards):  # 先确认结果一致
+        assert lists.check_game_over(b) == ai.check_game_over(bb)
+        assert lists.get_empty_positions(b) == ai.get_empty_positions(bb)
+
+    print("check_game_over")
+    a = bench("  列表", lists.check_game_over, boards)
+    b = bench("  位棋盘 (传入列表, 含转换)", ai.check_game_over, boards)
+    c = bench("  位棋盘 (传入 BitBoard)", ai.check_game_over, bitboards)
+    print(f"  加速比: {a / b:.1f}x / {a / c:.1f}x")
+
+    print("get_empty_positions")
+    a = bench("  列表", lists.get_empty_positions, boards)
+    c = bench("  位棋盘 (传入 BitBoard)", ai.get_empty_positions, bitboards)
+    print(f"  加速比: {a / c:.1f}x")
+
+    print("check_win")
+    a = bench("  列表", lambda b: lists.check_win(b, 1), boards)
+    c = bench("  位棋盘 (掩码)", lambda bb: has_win(bb.second), bitboards)
+    print(f"  加速比: {a / c:.1f}x")
+
+    print("转换")
+    bench("  BitBoard.from_list", BitBoard.from_list, boards)
+    bench("  BitBoard.to_list", BitBoard.to_list, bitboards)
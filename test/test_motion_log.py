@@ -0,0 +1,53 @@
+""" 运动日志往返测试: BambuMotion (接模拟打印机) 写出的 MOVE_LOG 能被 motion_model 读取并标定
+
+在仓库根目录运行: python test/test_motion_log.py  (或 python -m pytest test/test_motion_log.py)
+"""
+
+import os
+import sys
+import types
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+try:
+    import config  # noqa: F401  打印机地址和密码, 不在仓库中
+except ImportError:
+    sys.modules['config'] = types.SimpleNamespace(hostname='', access_code='', serial='')  # 模拟打印机用不到
+
+from fake_printer import FakeBambuClient
+from motion import BambuMotion
+from motion_model import read_move_log, fit
+from pump import FakePump
+
+
+def test_move_log_round_trip():
+    with tempfile.TemporaryDirectory() as tmp:
+        log_path = os.path.join(tmp, 'moves.jsonl')
+        os.environ['MOVE_LOG'] = log_path
+        try:
+            motion = BambuMotion(reset=False, client_factory=lambda: FakeBambuClient(time_scale=0.05), pump=FakePump())
+        finally:
+            del os.environ['MOVE_LOG']
+
+        motion.move(100, 100, 15)
+        with motion.batch() as batch:
+            batch.move(120, 80, 15)
+            batch.move_z(5)
+            batch.move_z(15)
+
+        assert motion.motion_stats['report'] == 2  # 两次都由打印机上报结束
+
+        records = read_move_log(log_path)
+        assert len(records) == 2
+        for record in records:
+            assert record['observed'] > 0
+            assert len(record['moves']) >= 1
+
+        model = fit(records)
+        assert model.overhead >= 0 and model.margin >= 0
+
+
+if __name__ == '__main__':
+    test_move_log_round_trip()
+    print("ok")
@@ -0,0 +1,41 @@
+""" 小块检测与整幅检测的角点偏差测试, 同时检查更换 REQUIRED_IDS 后能正常取角点
+
+在仓库根目录运行: python test/test_tag_tiles.py  (或 python -m pytest test/test_tag_tiles.py)
+"""
+
+import os
+import sys
+
+import cv2
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+import tags
+
+TOLERANCE = 0.5  # 像素
+
+
+def test_tile_search_matches_full_frame():
+    img = cv2.imread(os.path.join(ROOT, 'img', 'tag_4.png'))
+    img_gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+    required_ids = list(tags.REQUIRED_IDS)
+    tags.REQUIRED_IDS[:] = [4, 9, 19, 14]  # tag_4.png 上的是另一套底板标记
+    try:
+        tracker = tags.TagTracker()
+        quad_full, _ = tracker._detect(img, img_gray)  # 第一次没有历史位置, 整幅检测
+        quad_tile, _ = tracker._detect(img, img_gray)  # 第二次在小块内检测
+    finally:
+        tags.REQUIRED_IDS[:] = required_ids
+
+    assert tracker.stats['full_detects'] == 1 and tracker.stats['tile_detects'] == 1
+    error = np.linalg.norm(np.array(quad_full) - np.array(quad_tile), axis=1).max()
+    print(f"小块与整幅检测的角点最大偏差 {error:.3f} px")
+    assert error < TOLERANCE
+
+
+if __name__ == '__main__':
+    test_tile_search_matches_full_frame()
+    print("ok")